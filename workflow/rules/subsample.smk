@@ -1,48 +1,107 @@
 import pandas as pd
 
-samples_df = pd.read_csv(
+# Runs on its own, or included by the Snakefile in scaling mode. Names
+# defined here must not clash with the Snakefile's
+full_samples_df = pd.read_csv(
         config["samples"],
         sep = "\t",
         )
 
-SAMPLES = samples_df.sample_id.to_list()
+FULL_SAMPLES = full_samples_df.sample_id.to_list()
 
-datasets_params = { 
-        '1M' : 100000,
-        '2M' : 200000,
-        '5M' : 500000,
+# Datasets to subsample every sample to, see config.yaml
+datasets_params = config.get('scaling_datasets', {
+        '1M' : 1000000,
+        '2M' : 2000000,
+        '5M' : 5000000,
         '10M': 10000000,
         '20M': 20000000
-        }
+        })
 
+SUBSAMPLE_DATASETS = list(datasets_params)
 
-def get_fastqs(wc):
-    r1 = samples_df.loc[samples_df['sample_id'] == wc.sample]['R1'].values[0]
-    r2 = samples_df.loc[samples_df['sample_id'] == wc.sample]['R2'].values[0]
+SUBSAMPLE_MODE = config.get('subsample_mode', 'exact')
+if SUBSAMPLE_MODE not in ('exact', 'fraction'):
+    raise ValueError(
+            "subsample_mode must be exact or fraction, not {}".format(
+                SUBSAMPLE_MODE)
+            )
+
+
+def dataset_share(dataset, full_read_pairs=None):
+    '''
+    Expected share of its sample in dataset. None if that depends on the
+    read pairs of the sample and they are not given
+    '''
+    if SUBSAMPLE_MODE == 'fraction':
+        return min(1., float(datasets_params[dataset]))
+    if full_read_pairs is None:
+        return None
+    return min(1., datasets_params[dataset] / max(1., full_read_pairs))
+
+
+def get_full_fastqs(wc):
+    r1 = full_samples_df.loc[full_samples_df['sample_id'] == wc.sample]['R1'].values[0]
+    r2 = full_samples_df.loc[full_samples_df['sample_id'] == wc.sample]['R2'].values[0]
     return list((r1,r2))
 
-rule all:
+rule subsample_all:
     input:
         expand([
             "datasets/{dataset}/{sample}_{dataset}_R1.fastq.gz",
             "datasets/{dataset}/{sample}_{dataset}_R2.fastq.gz"
             ],
-            dataset=["1M", "2M", "5M", "10M", "20M"],
-            sample=SAMPLES,
+            dataset=SUBSAMPLE_DATASETS,
+            sample=FULL_SAMPLES,
             )
 
 rule subsample:
     output:
-        fq1 = "datasets/{dataset}/{sample}_{dataset}_R1.fastq.gz",
-        fq2 = "datasets/{dataset}/{sample}_{dataset}_R2.fastq.gz"
+        fq1 = expand(
+            "datasets/{dataset}/{{sample}}_{dataset}_R1.fastq.gz",
+            dataset=SUBSAMPLE_DATASETS),
+        fq2 = expand(
+            "datasets/{dataset}/{{sample}}_{dataset}_R2.fastq.gz",
+            dataset=SUBSAMPLE_DATASETS),
+        read_pairs = "datasets/{sample}.subsample.tsv"
     input:
-        fqs = get_fastqs
+        fqs = get_full_fastqs,
+        # Only exact mode needs the read pairs up front
+        total = (
+            "datasets/full/{sample}.read_pairs.txt"
+            if SUBSAMPLE_MODE == 'exact' else []
+            )
+    conda:
+        "../envs/assembly.yaml"
+    threads: 8
     params:
         rseed = 11,
-        no = lambda wc : datasets_params[wc.dataset]
+        # All datasets in one pass, -d name read_pairs R1 R2 for each
+        datasets = lambda wc, output: " ".join(
+            "-d {} {} {} {}".format(d, datasets_params[d], fq1, fq2)
+            for d, fq1, fq2 in zip(SUBSAMPLE_DATASETS, output.fq1, output.fq2)
+            ),
+        mode = SUBSAMPLE_MODE,
+        total = lambda wc, input: (
+            "-N $(cat {})".format(input.total)
+            if SUBSAMPLE_MODE == 'exact' else ""
+            ),
+        scrpt = srcdir("../scripts/subsample_fastq.py")
     shell:
-        "seqtk sample -s{params.rseed} {input.fqs[0]} {params.no}"
-        "| gzip -c > {output.fq1} && "
-        "seqtk sample -s{params.rseed} {input.fqs[1]} {params.no}"
-        "| gzip -c > {output.fq2}"
+        "python {params.scrpt} -1 {input.fqs[0]} -2 {input.fqs[1]} "
+        "-m {params.mode} {params.total} {params.datasets} "
+        "-s {params.rseed} -t {threads} -c {output.read_pairs}"
 
+rule count_reads:
+    output:
+        read_pairs = "datasets/full/{sample}.read_pairs.txt"
+    input:
+        fqs = get_full_fastqs
+    conda:
+        "../envs/assembly.yaml"
+    threads: 2
+    params:
+        scrpt = srcdir("../scripts/subsample_fastq.py")
+    shell:
+        "python {params.scrpt} -1 {input.fqs[0]} --count-only "
+        "-t {threads} > {output.read_pairs}"
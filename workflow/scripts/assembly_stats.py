@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+'''
+Basic assembly statistics in the report.tsv format of QUAST 5.0.2
+
+Only the reference free contiguity fields: contig counts and total
+lengths per size threshold, largest contig, GC, N50/N75, L50/L75 and Ns
+per 100 kbp. The fasta is read once, and only a histogram of contig
+lengths is kept, so memory does not grow with the assembly.
+'''
+
+import argparse
+import math
+from pathlib import Path
+
+from compressed_io import open_input
+
+
+# Same thresholds as QUAST's defaults
+THRESHOLDS = [0, 1000, 5000, 10000, 25000, 50000]
+MIN_CONTIG = 500
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Write QUAST's basic assembly statistics for a fasta, "
+            "without running QUAST"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-i",
+            "--input",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="Assembly fasta",
+            dest="input_fasta",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Output report.tsv",
+            dest="output_tsv",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-m",
+            "--min-contig",
+            type=int,
+            default=MIN_CONTIG,
+            dest="min_contig",
+            help="Contigs shorter than this only count towards the "
+            "(>= 0 bp) rows, as in QUAST [default = {}]".format(MIN_CONTIG)
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+class ContigCounts:
+    '''
+    Running totals over the contigs of an assembly
+    '''
+
+    def __init__(self, min_contig=MIN_CONTIG):
+        self.min_contig = min_contig
+        # length -> number of contigs
+        self.lengths = {}
+        # over contigs of at least min_contig
+        self.gc = 0
+        self.acgt = 0
+        self.n = 0
+
+    def add(self, seq):
+        length = len(seq)
+        self.lengths[length] = self.lengths.get(length, 0) + 1
+        if length < self.min_contig:
+            return
+        gc = seq.count(b'G') + seq.count(b'C') + seq.count(b'g') + seq.count(b'c')
+        self.gc += gc
+        self.acgt += gc + (seq.count(b'A') + seq.count(b'T')
+                + seq.count(b'a') + seq.count(b't'))
+        self.n += seq.count(b'N') + seq.count(b'n')
+
+
+def count_contigs(fasta, min_contig=MIN_CONTIG):
+    counts = ContigCounts(min_contig)
+    seq = []
+    in_record = False
+    with open_input(fasta, 'rb') as fin:
+        for line in fin:
+            if line.startswith(b'>'):
+                if in_record:
+                    counts.add(b''.join(seq))
+                in_record = True
+                seq = []
+            else:
+                seq.append(line.rstrip())
+    if in_record:
+        counts.add(b''.join(seq))
+    return counts
+
+
+def nx(lengths, total, fraction):
+    '''
+    Nx and Lx of the (length, number of contigs) pairs, longest first
+    '''
+    covered = 0
+    n_contigs = 0
+    for length, n in lengths:
+        # Contigs of the same length are taken one at a time
+        needed = fraction * total - covered
+        if n * length >= needed:
+            return length, n_contigs + math.ceil(needed / length)
+        covered += n * length
+        n_contigs += n
+    return None, None
+
+
+def report(counts, name):
+    '''
+    Rows of report.tsv, as (field, value)
+    '''
+    histogram = sorted(counts.lengths.items(), reverse=True)
+    rows = [('Assembly', name)]
+    for t in THRESHOLDS:
+        rows.append(('# contigs (>= {} bp)'.format(t),
+            sum(n for l, n in histogram if l >= t)))
+    for t in THRESHOLDS:
+        rows.append(('Total length (>= {} bp)'.format(t),
+            sum(l * n for l, n in histogram if l >= t)))
+
+    kept = [(l, n) for l, n in histogram if l >= counts.min_contig]
+    total = sum(l * n for l, n in kept)
+    n50, l50 = nx(kept, total, 0.5)
+    n75, l75 = nx(kept, total, 0.75)
+    rows += [
+            ('# contigs', sum(n for _, n in kept)),
+            ('Largest contig', histogram[0][0] if histogram else 0),
+            ('Total length', total),
+            ('GC (%)', '{:.2f}'.format(100 * counts.gc / counts.acgt)
+                if counts.acgt else '-'),
+            ('N50', n50 or '-'),
+            ('N75', n75 or '-'),
+            ('L50', l50 or '-'),
+            ('L75', l75 or '-'),
+            ("# N's per 100 kbp", '{:.2f}'.format(100000 * counts.n / total)
+                if total else '0.00'),
+            ]
+    return rows
+
+
+def main():
+    args = parse_arguments()
+
+    counts = count_contigs(args.input_fasta, args.min_contig)
+    # QUAST names the assembly after the file, without extension
+    rows = report(counts, args.input_fasta.stem)
+
+    args.output_tsv.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output_tsv, 'w') as fout:
+        for field, value in rows:
+            fout.write('{}\t{}\n'.format(field, value))
+
+
+if __name__ == '__main__':
+    main()
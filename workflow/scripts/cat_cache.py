@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+'''
+Cache of CAT contig classifications, keyed by contig sequence
+
+The classification of a contig by CAT contigs only depends on its sequence,
+the database and the parameters. Rows of contig2classification.txt are
+stored under a hash of the sequence, in a directory per database and
+parameters:
+
+    <cache>/<key digest>/key.txt        database files and parameters
+    <cache>/<key digest>/*.tsv          sequence hash, then the row without
+                                        the contig name
+
+Every run adds its new rows as a separate .tsv, renamed into place when
+complete, so concurrent jobs never write the same file. When there are
+more than MAX_FRAGMENTS, they are merged into one.
+
+    split   writes the contigs not in the cache to a fasta, for CAT
+    merge   writes the contig2classification.txt of all contigs, in the
+            order of the assembly, from the cache and the new CAT rows,
+            and adds the new rows to the cache
+'''
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from compressed_io import open_input
+from filter_contigs import read_fasta
+
+
+# Fragments of a cache directory above which they are merged
+MAX_FRAGMENTS = 32
+# Reads of the cache before a contig cached at the split counts as lost
+RELOAD_ATTEMPTS = 3
+C2C_HEADER = '# contig\tclassification\treason\tlineage\tlineage scores\n'
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Reuse the CAT contigs classifications of contigs "
+            "seen in earlier runs"
+            )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split = subparsers.add_parser("split",
+            help="Write the contigs without a cached classification")
+    merge = subparsers.add_parser("merge",
+            help="Write the contig2classification.txt of all contigs and "
+            "cache the new ones")
+
+    for sub in (split, merge):
+        sub.add_argument(
+                "-c",
+                "--contigs",
+                type=lambda p: Path(p).resolve(strict=True),
+                help="Fasta of the contigs, as given to CAT contigs",
+                dest="contigs",
+                required=True,
+                )
+        sub.add_argument(
+                "--cache",
+                type=lambda p: Path(p).resolve(),
+                help="Cache directory, shared by all samples",
+                dest="cache",
+                required=True,
+                )
+        sub.add_argument(
+                "-d",
+                "--database",
+                type=lambda p: Path(p).resolve(strict=True),
+                help="CAT database directory",
+                dest="database",
+                required=True,
+                )
+        sub.add_argument(
+                "-t",
+                "--taxonomy",
+                type=lambda p: Path(p).resolve(strict=True),
+                help="CAT taxonomy directory",
+                dest="taxonomy",
+                required=True,
+                )
+        sub.add_argument(
+                "-p",
+                "--params",
+                type=str,
+                default="",
+                help="Parameters of CAT contigs that change the "
+                "classification, and its version",
+                dest="params",
+                )
+
+    split.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Fasta of the contigs not in the cache",
+            dest="output",
+            required=True,
+            )
+
+    merge.add_argument(
+            "-n",
+            "--new",
+            type=lambda p: Path(p).resolve(),
+            help="contig2classification.txt of CAT for the contigs not in "
+            "the cache. Not read if none were missing",
+            dest="new",
+            required=True,
+            )
+    merge.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="contig2classification.txt of all contigs",
+            dest="output",
+            required=True,
+            )
+
+    return parser.parse_args()
+
+
+def files_key(directory):
+    '''
+    Names and sizes of the files of a CAT database or taxonomy directory.
+    Their names carry the date they were prepared
+    '''
+    return ['{}\t{}'.format(p.name, p.stat().st_size)
+            for p in sorted(directory.iterdir()) if p.is_file()]
+
+
+def cache_dir(cache, database, taxonomy, params):
+    '''
+    Directory of the cache for this database and parameters, created with
+    its key.txt if new
+    '''
+    key = '\n'.join(
+            ['database'] + files_key(database) +
+            ['taxonomy'] + files_key(taxonomy) +
+            ['params', ' '.join(params.split())]
+            ) + '\n'
+    directory = cache / hashlib.sha1(key.encode()).hexdigest()
+    if not directory.is_dir():
+        directory.mkdir(parents=True, exist_ok=True)
+        write_atomic(directory / 'key.txt', [key])
+    return directory
+
+
+def write_atomic(path, lines):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp.')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.writelines(lines)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def seq_hash(seq):
+    return hashlib.blake2b(seq.upper(), digest_size=16).hexdigest()
+
+
+def load_cache(directory):
+    '''
+    Sequence hash -> row of contig2classification.txt without the contig
+    name, and the fragments read
+    '''
+    rows = {}
+    fragments = []
+    for fragment in sorted(directory.glob('*.tsv')):
+        try:
+            with open(fragment, 'r') as fin:
+                for line in fin:
+                    key, _, row = line.partition('\t')
+                    rows[key] = row
+        except FileNotFoundError:
+            # Merged away by a concurrent job. Its rows are only missed
+            # by this run
+            continue
+        fragments.append(fragment)
+    return rows, fragments
+
+
+def contig_hashes(contigs):
+    '''
+    Name, sequence hash, header and sequence of every contig, in fasta
+    order
+    '''
+    with open_input(contigs, 'rb') as fin:
+        for header, seq in read_fasta(fin):
+            yield header.split(None, 1)[0].decode(), seq_hash(seq), header, seq
+
+
+def split(args):
+    directory = cache_dir(args.cache, args.database, args.taxonomy, args.params)
+    rows, _ = load_cache(directory)
+    n_cached = 0
+    n_missing = 0
+    with open(args.output, 'wb') as fout:
+        for name, key, header, seq in contig_hashes(args.contigs):
+            if key in rows:
+                n_cached += 1
+                continue
+            n_missing += 1
+            fout.write(b'>' + header + b'\n' + seq + b'\n')
+    print("{} contigs cached, {} to classify".format(n_cached, n_missing))
+
+
+def read_c2c(c2c):
+    rows = {}
+    with open(c2c, 'r') as fin:
+        for line in fin:
+            if line.startswith('#'):
+                continue
+            name, _, row = line.partition('\t')
+            rows[name] = row if row.endswith('\n') else row + '\n'
+    return rows
+
+
+def reload_row(directory, key, rows):
+    '''
+    Row of key from a fresh read of the cache, into rows. A contig cached
+    at the split can be missed by load_cache when a concurrent job merged
+    the fragment it is in away, between the glob and the read. Its rows
+    are then in the merged fragment
+    '''
+    for attempt in range(RELOAD_ATTEMPTS):
+        if attempt:
+            time.sleep(attempt)
+        reloaded, _ = load_cache(directory)
+        if key in reloaded:
+            rows.update(reloaded)
+            return reloaded[key]
+    return None
+
+
+def merge(args):
+    directory = cache_dir(args.cache, args.database, args.taxonomy, args.params)
+    rows, fragments = load_cache(directory)
+    new_rows = None
+    added = {}
+    n_cached = 0
+    with open(args.output, 'w') as fout:
+        fout.write(C2C_HEADER)
+        for name, key, _, _ in contig_hashes(args.contigs):
+            row = rows.get(key)
+            if row is None:
+                if new_rows is None:
+                    new_rows = read_c2c(args.new)
+                row = new_rows.get(name)
+                if row is None:
+                    row = reload_row(directory, key, rows)
+                    if row is None:
+                        raise ValueError(
+                                "{} is neither in the cache nor in {}, "
+                                "rerun the split".format(name, args.new)
+                                )
+                    n_cached += 1
+                else:
+                    rows[key] = row
+                    added[key] = row
+            else:
+                n_cached += 1
+            fout.write(name + '\t' + row)
+    print("{} contigs from the cache, {} new".format(n_cached, len(added)))
+
+    if not added:
+        return
+    compact = len(fragments) + 1 > MAX_FRAGMENTS
+    if compact:
+        # All rows, old and new, into a single fragment
+        added = rows
+    write_atomic(
+            directory / '{}.tsv'.format(uuid.uuid4().hex),
+            ['{}\t{}'.format(key, row) for key, row in added.items()]
+            )
+    if compact:
+        for fragment in fragments:
+            try:
+                fragment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'split':
+        split(args)
+    else:
+        merge(args)
+
+
+if __name__ == '__main__':
+    main()
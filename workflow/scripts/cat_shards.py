@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+'''
+Split contigs into shards for CAT contigs, and merge the shards' outputs
+
+    split   writes the contigs to n fastas of about the same total length,
+            assigning the longest contigs first to the shortest shard. Each
+            shard keeps the contigs in assembly order
+    merge   merges contig2classification.txt, ORF2LCA.txt, the predicted
+            proteins (.faa, .gff) and alignment.diamond of the shards in
+            assembly order, as if CAT had run on all contigs at once
+
+Shards left empty, and so not given to CAT, have no outputs. The outputs
+of a shard are held in memory while they are sorted.
+'''
+
+import argparse
+from heapq import heapify, heappop, heappush, merge as heap_merge
+from pathlib import Path
+
+from compressed_io import open_input
+from filter_contigs import read_fasta
+
+
+SUFFIXES = [
+        '.contig2classification.txt',
+        '.ORF2LCA.txt',
+        '.predicted_proteins.faa',
+        '.predicted_proteins.gff',
+        '.alignment.diamond',
+        ]
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Split contigs in shards of equal length for CAT "
+            "contigs, or merge the outputs of the shards"
+            )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split = subparsers.add_parser("split",
+            help="Split the contigs in shards")
+    merge = subparsers.add_parser("merge",
+            help="Merge the CAT outputs of the shards")
+
+    for sub in (split, merge):
+        sub.add_argument(
+                "-c",
+                "--contigs",
+                type=lambda p: Path(p).resolve(strict=True),
+                help="Fasta of all contigs",
+                dest="contigs",
+                required=True,
+                )
+
+    split.add_argument(
+            "-n",
+            "--shards",
+            type=int,
+            help="Number of shards",
+            dest="n_shards",
+            required=True,
+            )
+    split.add_argument(
+            "-o",
+            "--output-prefix",
+            type=str,
+            help="Shards are written to <prefix>.shard<i>.fa",
+            dest="prefix",
+            required=True,
+            )
+
+    merge.add_argument(
+            "-s",
+            "--shards",
+            nargs="+",
+            type=str,
+            help="Output prefixes of CAT contigs for the shards",
+            dest="shards",
+            required=True,
+            )
+    merge.add_argument(
+            "-o",
+            "--output-prefix",
+            type=str,
+            help="Prefix of the merged outputs",
+            dest="prefix",
+            required=True,
+            )
+
+    return parser.parse_args()
+
+
+def assign_shards(lengths, n_shards):
+    '''
+    Shard of every contig, balancing the total length of the shards
+    '''
+    shards = [0] * len(lengths)
+    # total length, shard
+    heap = [(0, i) for i in range(n_shards)]
+    heapify(heap)
+    for contig in sorted(range(len(lengths)), key=lambda c: -lengths[c]):
+        total, shard = heappop(heap)
+        shards[contig] = shard
+        heappush(heap, (total + lengths[contig], shard))
+    return shards
+
+
+def split(args):
+    with open_input(args.contigs, 'rb') as fin:
+        lengths = [len(seq) for _, seq in read_fasta(fin)]
+    shards = assign_shards(lengths, args.n_shards)
+
+    totals = [0] * args.n_shards
+    fouts = [open('{}.shard{}.fa'.format(args.prefix, i), 'wb')
+            for i in range(args.n_shards)]
+    try:
+        with open_input(args.contigs, 'rb') as fin:
+            for shard, (header, seq) in zip(shards, read_fasta(fin)):
+                fouts[shard].write(b'>' + header + b'\n' + seq + b'\n')
+                totals[shard] += len(seq)
+    finally:
+        for fout in fouts:
+            fout.close()
+    for i, total in enumerate(totals):
+        print("shard{}\t{} bp".format(i, total))
+
+
+def orf_contig(orf):
+    # ORFs are named <contig>_<n> by prodigal
+    return orf.rsplit('_', 1)[0]
+
+
+def read_header(fin, is_header):
+    '''
+    Header lines, and the first line after them or None
+    '''
+    header = []
+    for line in fin:
+        if not is_header(line):
+            return header, line
+        header.append(line)
+    return header, None
+
+
+def line_records(fin, contig_of):
+    '''
+    Header lines, and an iterator of (contig, line) of the other lines
+    '''
+    header, first = read_header(fin, lambda l: l.startswith('#'))
+
+    def records():
+        if first is None:
+            return
+        yield contig_of(first.split('\t', 1)[0]), first
+        for line in fin:
+            if not line.startswith('#'):
+                yield contig_of(line.split('\t', 1)[0]), line
+
+    return header, records()
+
+
+def block_records(fin, is_start, contig_of):
+    '''
+    Header lines, and an iterator of (contig, text) of records of several
+    lines, each starting with a line for which is_start holds
+    '''
+    header, first = read_header(fin, lambda l: not is_start(l))
+
+    def records():
+        if first is None:
+            return
+        contig, text = contig_of(first), [first]
+        for line in fin:
+            if is_start(line):
+                yield contig, ''.join(text)
+                contig, text = contig_of(line), [line]
+            else:
+                text.append(line)
+        yield contig, ''.join(text)
+
+    return header, records()
+
+
+def faa_records(fin):
+    return block_records(
+            fin,
+            lambda l: l.startswith('>'),
+            lambda l: orf_contig(l[1:].split(None, 1)[0])
+            )
+
+
+def gff_records(fin):
+    '''
+    Prodigal writes a '# Sequence Data' and '# Model Data' comment before
+    the genes of every contig, they stay with the genes
+    '''
+    return block_records(
+            fin,
+            lambda l: l.startswith('# Sequence Data'),
+            lambda l: l.split('seqhdr="', 1)[1].rstrip().rstrip('"').split(None, 1)[0]
+            )
+
+
+READERS = {
+        '.contig2classification.txt': lambda fin: line_records(fin, str),
+        '.ORF2LCA.txt': lambda fin: line_records(fin, orf_contig),
+        '.predicted_proteins.faa': faa_records,
+        '.predicted_proteins.gff': gff_records,
+        '.alignment.diamond': lambda fin: line_records(fin, orf_contig),
+        }
+
+
+def merge_outputs(shards, output, reader, order):
+    '''
+    Records of all shards in contig order. CAT does not keep the input
+    order in all outputs, e.g. contig2classification.txt is sorted by
+    contig name, so the records of every shard are sorted first. Records
+    of the same contig keep their order
+    '''
+    header = []
+    streams = []
+    key = lambda r: order[r[0]]
+    for shard in shards:
+        if not Path(shard).exists():
+            continue
+        with open(shard, 'r') as fin:
+            shard_header, records = reader(fin)
+            records = sorted(records, key=key)
+        if not header:
+            header = shard_header
+        streams.append(records)
+    with open(output, 'w') as fout:
+        fout.writelines(header)
+        for _, text in heap_merge(*streams, key=key):
+            fout.write(text)
+
+
+def merge(args):
+    with open_input(args.contigs, 'rb') as fin:
+        order = {
+                header.split(None, 1)[0].decode(): i
+                for i, (header, _) in enumerate(read_fasta(fin))
+                }
+    for suffix in SUFFIXES:
+        merge_outputs(
+                [shard + suffix for shard in args.shards],
+                args.prefix + suffix,
+                READERS[suffix],
+                order
+                )
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'split':
+        split(args)
+    else:
+        merge(args)
+
+
+if __name__ == '__main__':
+    main()
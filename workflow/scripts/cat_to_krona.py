@@ -4,6 +4,11 @@ import argparse
 from pathlib import Path
 from collections import Counter
 
+from compressed_io import open_input
+from names_cache import load_official_names
+from krona_common import read_manifest, run_batch
+from taxonomy_trie import TaxonomyTrie
+
 
 def parse_arguments():
     parser=argparse.ArgumentParser(
@@ -15,21 +20,36 @@ def parse_arguments():
 
     requiredArgs = parser.add_argument_group("Required Arguments")
 
-    requiredArgs.add_argument(
+    ioArgs = parser.add_argument_group(
+            "Input/Output",
+            "Either -i and -o for a single sample or --manifest for many"
+            )
+
+    ioArgs.add_argument(
             "-i",
             "--input",
             type=lambda p: Path(p).resolve(strict=True),
             help="<prefix>.contig2classification.txt output from CAT contigs",
             dest="input",
-            required=True,
+            required=False,
             )
-    requiredArgs.add_argument(
+    ioArgs.add_argument(
             "-o",
             "--output",
             type=lambda p: Path(p).resolve(),
             help="A ktImportText compatible file",
             dest="output",
-            required=True,
+            required=False,
+            )
+    ioArgs.add_argument(
+            "--manifest",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="A tab separated file with one sample per line: "
+            "contig2classification.txt, output file and, optionally, a file "
+            "for the contig counts that are otherwise printed to stdout. "
+            "All samples are converted in one go, loading names once",
+            dest="manifest",
+            required=False,
             )
     
     requiredArgs.add_argument(
@@ -41,6 +61,15 @@ def parse_arguments():
             required=True,
             type=lambda p: Path(p).resolve(strict=True)
             )
+    optionalArgs.add_argument(
+            "--names-cache",
+            dest="names_cache",
+            help="Binary cache of names.dmp, built by names_cache.py. It is "
+            "(re)built here if missing or stale [default = <names.dmp>.cache]",
+            required=False,
+            type=lambda p: Path(p).resolve(),
+            default=None
+            )
     optionalArgs.add_argument(
             "--include-stars",
             dest="include_stars",
@@ -51,88 +80,43 @@ def parse_arguments():
             )
     parser._action_groups.append(optionalArgs)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.manifest is None and (args.input is None or args.output is None):
+        parser.error("either -i and -o, or --manifest are required")
+    if args.manifest is not None and (args.input or args.output):
+        parser.error("--manifest can not be combined with -i/-o")
 
+    return args
 
 
-def parse_official_names(names_dmp):
-    '''
-    Get the scientific names for the numeric taxids 
-    '''
-    tax_dic = {}
-    with open(names_dmp, 'r') as fin:
-        for line in fin:
-            fields = [f.strip() for f in line.split('|')]
-            tax_id = fields[0]
-            if fields[3] == 'scientific name':
-                tax_dic[tax_id] = fields[1]
-    return tax_dic
-
 
-def cat_classifications_to_list(cat_input):
+def iter_cat_classifications(cat_input):
     '''
-    Make a list out of all cat classifications
+    Yield the numeric lineage of every contig in a contig2classification
+    file, or None for contigs without a taxid assigned
     '''
-    assigned = []
-    unassigned = 0
-    with open(cat_input, 'r') as fin:
+    with open_input(cat_input) as fin:
         for line in fin:
             if not line.startswith('#'):
-                fields = [f.strip() for f in line.split('\t')]
-                classification = fields[1]
+                fields = line.split('\t', 4)
+                classification = fields[1].strip()
                 if classification == 'taxid assigned':
-                    assigned.append(fields[3])
+                    yield fields[3].strip()
                 elif classification == 'no taxid assigned':
-                    unassigned += 1
-    
-    return assigned, unassigned
-
-
-def is_star(lineage_string):
-    if '*' in lineage_string:
-        return True
-    else:
-        return False
+                    yield None
 
 
-def translate_to_human_readable(lineage_string, tax_dic):
-    '''
-    Translate a numeric lineage string to human readable
+def count_cat_classifications(cat_input, trie):
     '''
-    human_tokens = []
-    for taxid in lineage_string.split(';'):
-        try:
-            taxname = tax_dic[taxid]
-            human_tokens.append(taxname)
-            human_string = ';'.join(human_tokens)
-        except:
-            print(lineage_string)
-            raise
-    return human_string
-
-
-
-def translate_classification_list(
-        class_list, 
-        tax_dic, 
-        include_stars=False
-        ):
+    Add the contigs per numeric lineage to trie, without holding on to any
+    per-contig data. Returns the contigs without a taxid
     '''
-    Map for the poor.
-    '''
-    translated_list = []
-    for i in class_list:
-        if is_star(i) and include_stars is True:
-            this_i = i.replace('*', '')
-            hr = translate_to_human_readable(this_i, tax_dic)
-            translated_list.append(hr)
-        elif is_star(i) and include_stars is False:
-            print("Skipping {}. No stars allowed".format(i))
-            continue
-        else:
-            hr = translate_to_human_readable(i,tax_dic)
-            translated_list.append(hr)
-    return translated_list
+    # Contigs share a few thousand lineages, count them before they go in
+    lineage_counts = Counter(iter_cat_classifications(cat_input))
+    unassigned = lineage_counts.pop(None, 0)
+    for lineage, count in lineage_counts.items():
+        trie.add(lineage, count)
+    return unassigned
 
 
 def counter_to_tsv(count_dic, outfile):
@@ -141,30 +125,50 @@ def counter_to_tsv(count_dic, outfile):
     '''
     with open(outfile, 'w') as fout:
         for k, v in count_dic.items():
-            taxonomy = k.replace(';', '\t')
+            taxonomy = '\t'.join(k)
             fout.write('{}\t{}\n'.format(v, taxonomy))
 
 
-def main():
-    args = parse_arguments()
-    
-    tax_dic = parse_official_names(args.names_dmp)
-
-    assigned, unassigned = cat_classifications_to_list(args.input)
+def cat_to_krona(cat_input, output, trie, include_stars=False):
+    '''
+    Convert one contig2classification.txt to a ktImportText table
+    '''
+    trie.clear_counts()
+    unassigned = count_cat_classifications(cat_input, trie)
+    assigned = sum(trie.counts[0])
 
-    print("Assigned: {}".format(len(assigned)))
+    print("Assigned: {}".format(assigned))
     print("Unassigned: {}".format(unassigned))
-    print("Total: {}".format(sum([len(assigned), unassigned])))
+    print("Total: {}".format(sum([assigned, unassigned])))
+
+    if include_stars is False:
+        for node in trie.nodes_with_counts():
+            if trie.is_starred(node):
+                print("Skipping {} ({} contigs). No stars allowed".format(
+                    trie.lineage_string(node), trie.counts[0][node]))
+
+    count_dic = trie.krona_counts(include_stars=include_stars)
 
-    translated_list = translate_classification_list(
-            assigned, tax_dic, include_stars=args.include_stars)
+    if ('root',) in count_dic:
+        count_dic[('root',)] += unassigned
 
-    count_dic = Counter(translated_list)
+    counter_to_tsv(count_dic, output)
 
-    if 'root' in count_dic:
-        count_dic['root'] += unassigned
 
-    counter_to_tsv(count_dic, args.output)
+def main():
+    args = parse_arguments()
+    
+    tax_dic = load_official_names(args.names_dmp, args.names_cache)
+    trie = TaxonomyTrie(tax_dic)
+
+    def convert(cat_input, output):
+        cat_to_krona(cat_input, output, trie,
+                include_stars=args.include_stars)
+
+    if args.manifest:
+        run_batch(read_manifest(args.manifest, 3), convert)
+    else:
+        convert(args.input, args.output)
 
 
 if __name__ == '__main__':
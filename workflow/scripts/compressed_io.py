@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+'''
+Read and write plain, gzip, bgzip and zstd files alike
+
+The format of an input is found from its first bytes, not its name. The
+format of an output from its suffix: .gz, .bgz or .zst, plain otherwise.
+
+Compressed files go through an external program in its own process when
+one is on the PATH, so (de)compression runs next to the parsing: bgzip
+with -@ threads (BGZF blocks are decompressed in parallel), pigz and
+zstd -T. Without them, Python's gzip module, or the zstandard module if
+installed, are used in process.
+
+Run as a script, it benchmarks reading and writing a plain text file in
+every format against the plain file itself.
+'''
+
+import argparse
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+SUFFIXES = {
+        '.gz': 'gzip',
+        '.bgz': 'bgzip',
+        '.zst': 'zstd',
+        '.zstd': 'zstd',
+        }
+FORMATS = ['plain', 'gzip', 'bgzip', 'zstd']
+BUFFER_SIZE = 1024**2
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Benchmark reading and writing a text file plain, "
+            "gzip, bgzip and zstd compressed"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-i",
+            "--input",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="A text file, e.g. names.dmp or a read2classification.txt",
+            dest="input",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-f",
+            "--formats",
+            nargs="+",
+            choices=FORMATS,
+            default=FORMATS,
+            dest="formats",
+            help="Formats to benchmark [default = all]"
+            )
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=4,
+            dest="threads",
+            help="Threads of the external (de)compressors [default = 4]"
+            )
+    optionalArgs.add_argument(
+            "-d",
+            "--tmpdir",
+            type=lambda p: Path(p).resolve(strict=True),
+            default=None,
+            dest="tmpdir",
+            help="Where to write the compressed copies. Put it on the "
+            "filesystem to benchmark [default = next to the input]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def detect_format(path):
+    '''
+    'gzip', 'bgzip', 'zstd' or 'plain', from the first bytes of path
+    '''
+    with open(path, 'rb') as fin:
+        head = fin.read(14)
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    if head.startswith(GZIP_MAGIC):
+        # BGZF members have the FEXTRA flag and a 'BC' extra subfield
+        if len(head) == 14 and head[3] & 4 and head[12:14] == b'BC':
+            return 'bgzip'
+        return 'gzip'
+    return 'plain'
+
+
+def output_format(path):
+    return SUFFIXES.get(Path(path).suffix, 'plain')
+
+
+def decompressor_cmd(fmt, threads=1):
+    '''
+    Command that decompresses a file of fmt to stdout, None if there is no
+    program for it
+    '''
+    threads = str(max(1, threads))
+    if fmt == 'bgzip' and shutil.which('bgzip'):
+        return [shutil.which('bgzip'), '-@', threads, '-dc']
+    if fmt in ('gzip', 'bgzip'):
+        # pigz decompresses in one thread, but reads, writes and checks in
+        # others
+        for program in ('pigz', 'gzip'):
+            if shutil.which(program):
+                return [shutil.which(program), '-dc']
+    if fmt == 'zstd' and shutil.which('zstd'):
+        return [shutil.which('zstd'), '-dcq']
+    return None
+
+
+def compressor_cmd(fmt, threads=1):
+    '''
+    Command that compresses stdin to stdout in fmt, None if there is no
+    program for it
+    '''
+    threads = str(max(1, threads))
+    if fmt == 'bgzip' and shutil.which('bgzip'):
+        return [shutil.which('bgzip'), '-@', threads, '-c']
+    if fmt == 'gzip':
+        if shutil.which('pigz'):
+            return [shutil.which('pigz'), '-p', threads, '-c']
+        if shutil.which('gzip'):
+            return [shutil.which('gzip'), '-c']
+    if fmt == 'zstd' and shutil.which('zstd'):
+        return [shutil.which('zstd'), '-T' + threads, '-cq']
+    return None
+
+
+class ProcessReader(io.RawIOBase):
+    '''
+    The stdout of a decompressor. Closing it before the end stops the
+    decompressor, a failure of it is raised otherwise
+    '''
+
+    def __init__(self, cmd):
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+        self.pipe = self.proc.stdout
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.pipe.readinto(buffer)
+        if n == 0:
+            self.eof = True
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        if not self.eof:
+            self.proc.terminate()
+        self.pipe.close()
+        returncode = self.proc.wait()
+        super().close()
+        if self.eof and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.proc.args)
+
+
+class ProcessWriter(io.RawIOBase):
+    '''
+    The stdin of a compressor writing to path
+    '''
+
+    def __init__(self, cmd, path):
+        self.fout = open(path, 'wb')
+        self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=self.fout,
+                bufsize=0
+                )
+        self.pipe = self.proc.stdin
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.pipe.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.pipe.close()
+        returncode = self.proc.wait()
+        self.fout.close()
+        super().close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.proc.args)
+
+
+def no_program(fmt):
+    if fmt == 'zstd':
+        return ValueError(
+                "Found no zstd on the PATH and the zstandard module is not "
+                "installed"
+                )
+    return ValueError("Found no {} on the PATH".format(fmt))
+
+
+def open_input(path, mode='r', threads=1):
+    '''
+    Open path for reading, decompressing it if needed. mode is 'r' or
+    'rb'. threads only matter for bgzip
+    '''
+    fmt = detect_format(path)
+    if fmt == 'plain':
+        return open(path, mode)
+
+    cmd = decompressor_cmd(fmt, threads)
+    if cmd is not None:
+        fin = io.BufferedReader(ProcessReader(cmd + [str(path)]), BUFFER_SIZE)
+    elif fmt == 'zstd':
+        if zstandard is None:
+            raise no_program(fmt)
+        fin = zstandard.open(path, 'rb')
+    else:
+        fin = gzip.open(path, 'rb')
+    if 'b' in mode:
+        return fin
+    return io.TextIOWrapper(fin)
+
+
+def open_output(path, mode='w', threads=1):
+    '''
+    Open path for writing, compressed according to its suffix. mode is
+    'w' or 'wb'
+    '''
+    fmt = output_format(path)
+    if fmt == 'plain':
+        return open(path, mode)
+
+    cmd = compressor_cmd(fmt, threads)
+    if cmd is not None:
+        fout = io.BufferedWriter(ProcessWriter(cmd, path), BUFFER_SIZE)
+    elif fmt == 'zstd' and zstandard is not None:
+        fout = zstandard.open(path, 'wb')
+    elif fmt == 'gzip':
+        fout = gzip.open(path, 'wb')
+    else:
+        raise no_program(fmt)
+    if 'b' in mode:
+        return fout
+    return io.TextIOWrapper(fout)
+
+
+def is_seekable(path):
+    '''
+    True if path can be read in byte ranges, i.e. is not compressed
+    '''
+    return detect_format(path) == 'plain'
+
+
+def time_read(path, threads):
+    start = time.perf_counter()
+    lines = 0
+    with open_input(path, 'rb', threads) as fin:
+        for _ in fin:
+            lines += 1
+    return time.perf_counter() - start, lines
+
+
+def time_write(source, path, threads):
+    start = time.perf_counter()
+    with open(source, 'rb') as fin, open_output(path, 'wb', threads) as fout:
+        shutil.copyfileobj(fin, fout, BUFFER_SIZE)
+    return time.perf_counter() - start
+
+
+def benchmark(source, formats, threads=4, tmpdir=None):
+    '''
+    Size, write and read time of source in every format. Formats without
+    a program or module are skipped
+    '''
+    size = os.path.getsize(source)
+    suffixes = {fmt: suffix for suffix, fmt in SUFFIXES.items()}
+    results = []
+    with tempfile.TemporaryDirectory(dir=tmpdir or source.parent) as tmp:
+        for fmt in formats:
+            if fmt == 'plain':
+                path = source
+                write_s = None
+            else:
+                path = Path(tmp) / (source.name + suffixes[fmt])
+                try:
+                    write_s = time_write(source, path, threads)
+                except ValueError as e:
+                    print("Skipping {}: {}".format(fmt, e))
+                    continue
+            read_s, _ = time_read(path, threads)
+            results.append((fmt, os.path.getsize(path), write_s, read_s))
+    return size, results
+
+
+def main():
+    args = parse_arguments()
+
+    size, results = benchmark(args.input, args.formats, args.threads,
+            args.tmpdir)
+    mb = size / 1024**2
+    plain_s = dict((r[0], r[3]) for r in results).get('plain')
+    print('format\tsize_mb\tratio\twrite_mb_s\tread_mb_s\tread_vs_plain')
+    for fmt, fmt_size, write_s, read_s in results:
+        print('{}\t{:.1f}\t{:.2f}\t{}\t{:.1f}\t{}'.format(
+            fmt,
+            fmt_size / 1024**2,
+            size / fmt_size,
+            '-' if write_s is None else '{:.1f}'.format(mb / write_s),
+            mb / read_s,
+            '-' if plain_s is None else '{:.2f}'.format(plain_s / read_s)
+            ))
+
+
+if __name__ == '__main__':
+    main()
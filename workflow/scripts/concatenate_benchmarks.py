@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 
 import argparse
+import io
 from pathlib import Path
 import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 
 
@@ -46,7 +51,27 @@ def parse_arguments():
             "this will generate a column 'meta' with the values of A or B "
             "included"
             )
-
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            required=False,
+            type=int,
+            default=8,
+            dest="threads",
+            help="Number of threads used to read the benchmark files "
+            "[default = 8]"
+            )
+    optionalArgs.add_argument(
+            "-s",
+            "--store",
+            required=False,
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="store",
+            help="Keep the parsed benchmarks in this file and only parse "
+            "new or changed benchmark files on the next run "
+            "[default = <output>.store.pkl]"
+            )
 
     parser._action_groups.append(optionalArgs)
 
@@ -54,26 +79,172 @@ def parse_arguments():
 
 
 
-def tsv_to_df(input_tsv, patterns=None):
-    fp_name = input_tsv.name
-    sample_id = fp_name.split('.')[0]
-    rule_info = fp_name.split('.')[1]
-    assembler = rule_info.split('_')[-1]
-    rule = '_'.join(rule_info.split('_')[:-1])
-    df = pd.read_csv(
-            input_tsv,
-            sep='\t',
-            na_values='-'
-            )
-    df['sample_id'] = sample_id
-    df['rule'] = rule
-    df['assembler'] = assembler
-    if patterns:
+def scan_benchmark_files(benchmarks_dir):
+    '''
+    Map every benchmark file to its mtime
+    '''
+    return {
+            entry.path: entry.stat().st_mtime_ns
+            for entry in os.scandir(benchmarks_dir)
+            if entry.is_file()
+            }
+
+
+def read_texts(paths, threads=8):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda p: Path(p).read_text(), paths))
+
+
+def parse_benchmark_texts(texts):
+    '''
+    Parse the contents of many benchmark files with one read_csv call per
+    distinct header (normally a single one). Returns the data and, for
+    every input, the number of rows it contributed.
+    '''
+    groups = {}
+    n_rows = np.zeros(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        header, _, body = text.partition('\n')
+        lines = [l for l in body.splitlines() if l.strip()]
+        n_rows[i] = len(lines)
+        if lines:
+            indices, group_lines = groups.setdefault(header, ([], []))
+            indices.append(i)
+            group_lines.extend(lines)
+
+    if not groups:
+        return pd.DataFrame(), n_rows
+
+    dfs = []
+    order = []
+    for header, (indices, lines) in groups.items():
+        buffer = io.StringIO(header + '\n' + '\n'.join(lines) + '\n')
+        dfs.append(pd.read_csv(buffer, sep='\t', na_values='-'))
+        order.append(np.repeat(indices, n_rows[indices]))
+
+    df = pd.concat(dfs, ignore_index=True)
+    # Different headers only come from mixing snakemake versions. Put the
+    # rows back in input order
+    if len(dfs) > 1:
+        order = np.argsort(np.concatenate(order), kind='stable')
+        df = df.iloc[order].reset_index(drop=True)
+    return df, n_rows
+
+
+def parse_file_names(paths):
+    '''
+    Get sample_id, rule and assembler out of <sample>.<rule>_<assembler>.tsv
+    for all paths at once
+    '''
+    names = pd.Series([p.name for p in paths], dtype=object)
+    name_parts = names.str.split('.', n=2, expand=True)
+    rule_parts = name_parts[1].str.rpartition('_')
+    return pd.DataFrame({
+        'sample_id': name_parts[0],
+        'rule': rule_parts[0],
+        'assembler': rule_parts[2],
+        })
+
+
+def load_benchmarks(paths, threads=8):
+    '''
+    Read benchmark files into one table, with the file name metadata as
+    categorical columns
+    '''
+    paths = [Path(p) for p in paths]
+    df, n_rows = parse_benchmark_texts(read_texts(paths, threads))
+    if df.empty:
+        return df
+
+    meta = parse_file_names(paths)
+    meta['path'] = [str(p) for p in paths]
+    for col in meta.columns:
+        df[col] = pd.Categorical(np.repeat(meta[col].to_numpy(), n_rows))
+    return df
+
+
+def read_store(store_path, files):
+    '''
+    Stored rows of the files that are unchanged (path -> mtime), None if
+    there is no usable store. A pickle is tied to the pandas version that
+    wrote it, so a store that fails to load or to filter is ignored and
+    everything is parsed again
+    '''
+    if not store_path.exists():
+        return None
+    try:
+        stored = pd.read_pickle(store_path)
+        if not {'path', 'mtime_ns'}.issubset(stored.columns):
+            return None
+        current_mtime = stored['path'].astype(object).map(files)
+        return stored[(current_mtime == stored['mtime_ns']).to_numpy()]
+    except Exception as e:
+        print("Ignoring unreadable store {}: {}".format(store_path, e))
+        return None
+
+
+def write_store(df, store_path):
+    '''
+    Write the store next to its final location and rename it, so an
+    interrupted run never leaves a truncated store behind
+    '''
+    fd, tmp_path = tempfile.mkstemp(
+            dir=store_path.parent, prefix=store_path.name + '.')
+    os.close(fd)
+    try:
+        df.to_pickle(tmp_path)
+        # mkstemp creates the file 0600
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, store_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def update_benchmarks(files, store_path, threads=8):
+    '''
+    Bring the stored benchmarks up to date with files (path -> mtime).
+    Rows of deleted or changed files are dropped and only new or changed
+    files are parsed.
+    '''
+    stored = read_store(store_path, files)
+    if stored is not None:
+        seen = set(stored['path'].astype(object))
+    else:
+        seen = set()
+
+    new_paths = sorted(p for p in files if p not in seen)
+    print("Parsing {} new or changed benchmark files".format(len(new_paths)))
+    new = load_benchmarks(new_paths, threads)
+    if not new.empty:
+        new['mtime_ns'] = new['path'].astype(object).map(files)
+
+    parts = [d for d in (stored, new) if d is not None and not d.empty]
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    for col in ['sample_id', 'rule', 'assembler', 'path']:
+        if col in df:
+            df[col] = df[col].astype('category')
+
+    write_store(df, store_path)
+    return df
+
+
+def add_meta_columns(df, patterns):
+    '''
+    Add a column per --meta group, based on the sample_id prefixes
+    '''
+    sample_ids = df['sample_id'].astype('category')
+    for meta_col in set(v[0] for v in patterns.values()):
+        values = pd.Series(None, index=sample_ids.cat.categories, dtype=object)
         for p in patterns:
-            if sample_id.startswith(patterns[p][1]):
-                df[patterns[p][0]] = p
+            if patterns[p][0] == meta_col:
+                values[values.index.str.startswith(patterns[p][1])] = p
+        df[meta_col] = pd.Categorical(sample_ids.map(values))
     return df
 
+
 def main():
     args = parse_arguments()
 
@@ -100,18 +271,26 @@ def main():
     if args.meta:
         patterns = {i[1] : (i[0],i[2]) for i in args.meta}
     
-    all_dfs = []
-    for path in args.input.iterdir():
-        if path.is_file():
-            all_dfs.append(tsv_to_df(path, patterns))
+    store = args.store
+    if store is None:
+        store = args.output.parent / Path(args.output.name + '.store.pkl')
+
+    master_df = update_benchmarks(
+            scan_benchmark_files(args.input),
+            store,
+            threads=args.threads
+            )
+    if master_df.empty:
+        raise ValueError("No benchmark results found in {}".format(args.input))
 
-    master_df = pd.concat(all_dfs)
     if patterns:
+        master_df = add_meta_columns(master_df, patterns)
         for p in patterns:
             if patterns[p][0] not in cols:
                 cols.append(patterns[p][0])
+    # Same order whether the rows come from the store or were just parsed
+    master_df = master_df.sort_values(by=['sample_id', 'path'], kind='mergesort')
     master_df = master_df[cols]
-    master_df = master_df.sort_values(by='sample_id')
     master_df.to_csv(args.output, 
             sep="\t", 
             index=False,
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+'''
+Filter an assembly by contig length in one pass
+
+Writes the contigs of at least the minimum length, with their samtools
+faidx index and a BED of their full extent, and the lengths of all contigs
+as a numpy .npy array. Runs without numpy, the .npy is written directly.
+'''
+
+import argparse
+from array import array
+from pathlib import Path
+
+from compressed_io import open_input
+from npy_format import write_npy
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Keep contigs of a minimum length and write their "
+            ".fai index, a BED of them and the lengths of all contigs"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-i",
+            "--input",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="Assembly fasta",
+            dest="input_fasta",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Filtered fasta. The index is written next to it, as "
+            "<output>.fai",
+            dest="output_fasta",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-b",
+            "--bed",
+            type=lambda p: Path(p).resolve(),
+            help="BED of the filtered contigs",
+            dest="output_bed",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-l",
+            "--lengths",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="output_lengths",
+            help="Write the lengths of all contigs, in assembly order, to "
+            "this .npy file"
+            )
+    optionalArgs.add_argument(
+            "-m",
+            "--min-length",
+            type=int,
+            default=1500,
+            dest="min_length",
+            help="Minimum contig length [default = 1500]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def read_fasta(fin):
+    '''
+    Yield header line (without '>') and sequence of every record
+    '''
+    header = None
+    seq = []
+    for line in fin:
+        if line.startswith(b'>'):
+            if header is not None:
+                yield header, b''.join(seq)
+            header = line[1:].rstrip()
+            seq = []
+        else:
+            seq.append(line.rstrip())
+    if header is not None:
+        yield header, b''.join(seq)
+
+
+def filter_contigs(input_fasta, output_fasta, output_bed, min_length=1500):
+    '''
+    Write the contigs of at least min_length, one sequence line each as
+    seqtk does, with their .fai and BED. Returns the lengths of all
+    contigs.
+    '''
+    lengths = array('Q')
+    offset = 0
+    with open_input(input_fasta, 'rb') as fin, \
+            open(output_fasta, 'wb') as fasta, \
+            open(str(output_fasta) + '.fai', 'w') as fai, \
+            open(output_bed, 'w') as bed:
+        for header, seq in read_fasta(fin):
+            length = len(seq)
+            lengths.append(length)
+            if length < min_length:
+                continue
+            name = header.split(None, 1)[0].decode()
+            fasta.write(b'>' + header + b'\n' + seq + b'\n')
+            offset += len(header) + 2
+            # name, length, offset, bases per line, bytes per line
+            fai.write('{}\t{}\t{}\t{}\t{}\n'.format(
+                name, length, offset, length, length + 1))
+            bed.write('{}\t0\t{}\n'.format(name, length))
+            offset += length + 1
+    return lengths
+
+
+def main():
+    args = parse_arguments()
+
+    lengths = filter_contigs(
+            args.input_fasta,
+            args.output_fasta,
+            args.output_bed,
+            min_length=args.min_length
+            )
+    kept = sum(1 for l in lengths if l >= args.min_length)
+    print("Kept {} of {} contigs of at least {} bp".format(
+        kept, len(lengths), args.min_length))
+
+    if args.output_lengths:
+        write_npy(args.output_lengths, lengths)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+'''
+Fit how the cost of every rule scales with the number of read pairs
+
+Uses the benchmarks of the subsampled datasets of scaling mode. For each
+rule, assembler and metric a power law
+
+    metric = coefficient * (million read pairs) ** exponent
+
+is fit and used to project the cost at the size of the full samples, and
+at any other size asked for.
+'''
+
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from resource_model import fit_power_law
+
+
+METRICS = ['s', 'max_rss', 'io_in', 'io_out', 'cpu_time']
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Fit runtime, memory and I/O of every rule against "
+            "the number of read pairs and project them to the full samples"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-b",
+            "--benchmarks",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="The aggregated benchmarks, as written by "
+            "concatenate_benchmarks.py",
+            dest="benchmarks_tsv",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-d",
+            "--datasets",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="The scaling datasets, with sample_id, sample, dataset, "
+            "read_pairs and full_read_pairs columns",
+            dest="datasets_tsv",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="A directory for scaling_table.tsv, scaling_fits.tsv and "
+            "projections.tsv",
+            dest="output",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-p",
+            "--project",
+            type=float,
+            nargs="+",
+            default=[],
+            dest="project",
+            help="Also project to these sizes, in million read pairs"
+            )
+    optionalArgs.add_argument(
+            "-m",
+            "--metrics",
+            nargs="+",
+            default=METRICS,
+            dest="metrics",
+            help="Benchmark columns to fit [default = {}]".format(
+                ' '.join(METRICS))
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def scaling_table(benchmarks, datasets):
+    '''
+    Benchmarks of the scaling datasets only, with their sample, dataset
+    and size
+    '''
+    datasets = datasets[
+            ['sample_id', 'sample', 'dataset', 'read_pairs', 'full_read_pairs']
+            ]
+    table = benchmarks.merge(datasets, on='sample_id', how='inner')
+    table['million_read_pairs'] = table['read_pairs'] / 1e6
+    return table
+
+
+def fit_scaling(table, metrics=METRICS):
+    fits = []
+    for (rule, assembler), group in table.groupby(['rule', 'assembler'], observed=True):
+        for metric in metrics:
+            # Every dataset has reads, there is no size to floor at
+            fit = fit_power_law(group['million_read_pairs'], group[metric],
+                    min_x=None)
+            if fit is None:
+                continue
+            fits.append({
+                'rule': rule,
+                'assembler': assembler,
+                'metric': metric,
+                'n': fit['n'],
+                'exponent': fit['slope'],
+                'coefficient': np.exp(fit['intercept']),
+                'r2': fit['r2'],
+                # Upper bound over the fit, as in resource_model.py
+                'margin_factor': np.exp(fit['margin']),
+                'max_fitted_million_read_pairs': group['million_read_pairs'].max(),
+                })
+    return pd.DataFrame(fits, columns=[
+        'rule', 'assembler', 'metric', 'n', 'exponent', 'coefficient', 'r2',
+        'margin_factor', 'max_fitted_million_read_pairs'
+        ])
+
+
+def project(fits, targets):
+    '''
+    Cost of every fit at every target, a mapping of name to million read
+    pairs
+    '''
+    rows = []
+    for fit in fits.itertuples(index=False):
+        for target, size in targets.items():
+            predicted = fit.coefficient * size**fit.exponent
+            rows.append({
+                'rule': fit.rule,
+                'assembler': fit.assembler,
+                'metric': fit.metric,
+                'target': target,
+                'million_read_pairs': size,
+                'predicted': predicted,
+                'upper': predicted * fit.margin_factor,
+                # How far beyond the fitted sizes this reaches
+                'extrapolation': size / fit.max_fitted_million_read_pairs,
+                })
+    return pd.DataFrame(rows, columns=[
+        'rule', 'assembler', 'metric', 'target', 'million_read_pairs',
+        'predicted', 'upper', 'extrapolation'
+        ])
+
+
+def main():
+    args = parse_arguments()
+
+    benchmarks = pd.read_csv(args.benchmarks_tsv, sep='\t', na_values='-')
+    datasets = pd.read_csv(args.datasets_tsv, sep='\t')
+    table = scaling_table(benchmarks, datasets)
+    if table.empty:
+        raise ValueError(
+                "No benchmarks of the datasets in {} found in {}".format(
+                    args.datasets_tsv, args.benchmarks_tsv)
+                )
+
+    fits = fit_scaling(table, args.metrics)
+
+    full_sizes = datasets.groupby('sample')['full_read_pairs'].first() / 1e6
+    targets = full_sizes.to_dict()
+    for size in args.project:
+        targets['{:g}M'.format(size)] = size
+    projections = project(fits, targets)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output / Path('scaling_table.tsv'),
+            sep='\t', index=False, na_rep='-')
+    fits.to_csv(args.output / Path('scaling_fits.tsv'),
+            sep='\t', index=False, float_format='%.4g')
+    projections.to_csv(args.output / Path('projections.tsv'),
+            sep='\t', index=False, float_format='%.4g')
+    print("Fit {} rule, assembler and metric combinations on {} runs".format(
+        len(fits), len(table)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''
+Merge the ktImportText tables of all samples into one cohort table
+
+The cohort table is a sparse lineage x sample matrix, written as
+
+    <prefix>.lineages.tsv   lineage_id, lineage (tab separated levels)
+    <prefix>.counts.tsv     lineage_id, sample, assembler, count
+
+with only the non-zero counts. The parsed table of every sample is kept
+in a store next to them, so adding or changing a sample only reads that
+one again. From the cohort, the ktImportText inputs of every assembler are
+written, optionally pruned to the lineages that matter in some sample, so
+that the Krona html of thousands of samples stays loadable.
+'''
+
+import argparse
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from compressed_io import open_input
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Merge per sample krona tables into a cohort table "
+            "and write pruned ktImportText inputs per assembler"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "--manifest",
+            type=lambda p: Path(p).resolve(strict=True),
+            dest="manifest",
+            required=True,
+            help="A tab separated file with one table per line: sample, "
+            "assembler and its ktImportText table"
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output-prefix",
+            type=lambda p: Path(p).resolve(),
+            dest="prefix",
+            required=True,
+            help="Write the cohort table to <prefix>.lineages.tsv and "
+            "<prefix>.counts.tsv"
+            )
+    requiredArgs.add_argument(
+            "-k",
+            "--krona-dir",
+            type=lambda p: Path(p).resolve(),
+            dest="krona_dir",
+            required=True,
+            help="Write the ktImportText inputs to <dir>/<assembler>/"
+            "<sample>.krona.txt, and the arguments for ktImportText to "
+            "<dir>/<assembler>.inputs.txt"
+            )
+    optionalArgs.add_argument(
+            "--top",
+            type=int,
+            default=0,
+            dest="top",
+            help="Keep only the lineages among the top N of some sample "
+            "[default = 0, all]"
+            )
+    optionalArgs.add_argument(
+            "--min-fraction",
+            type=float,
+            default=0.,
+            dest="min_fraction",
+            help="Keep only the lineages with at least this fraction of the "
+            "counts of some sample [default = 0, all]"
+            )
+    optionalArgs.add_argument(
+            "--store",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="store",
+            help="Parsed tables are kept here and reused while the table "
+            "does not change [default = <prefix>.store.pkl]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def read_runs_manifest(manifest_tsv):
+    runs = []
+    with open(manifest_tsv, 'r') as fin:
+        for line_no, line in enumerate(fin, start=1):
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                raise ValueError(
+                        "{}:{}: expected 3 columns, found {}".format(
+                            manifest_tsv, line_no, len(fields))
+                        )
+            runs.append((fields[0], fields[1], Path(fields[2]).resolve()))
+    return runs
+
+
+def read_krona_txt(krona_txt):
+    '''
+    Counts per lineage, a tuple of levels, of a ktImportText table
+    '''
+    column = {}
+    with open_input(krona_txt) as fin:
+        for line in fin:
+            fields = line.rstrip('\n').split('\t')
+            if not fields[0]:
+                continue
+            lineage = tuple(fields[1:])
+            column[lineage] = column.get(lineage, 0) + int(float(fields[0]))
+    return column
+
+
+def read_store(store_path):
+    if not store_path.exists():
+        return {}
+    try:
+        with open(store_path, 'rb') as fin:
+            return pickle.load(fin)
+    except Exception as e:
+        print("Ignoring unreadable store {}: {}".format(store_path, e))
+        return {}
+
+
+def write_store(store, store_path):
+    '''
+    Write the store next to its final location and rename it, so an
+    interrupted run never leaves a truncated store behind
+    '''
+    fd, tmp_path = tempfile.mkstemp(
+            dir=store_path.parent, prefix=store_path.name + '.')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            pickle.dump(store, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        # mkstemp creates the file 0600
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, store_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_columns(runs, store_path):
+    '''
+    The table of every (sample, assembler, path) in runs. Only tables not
+    in the store, or changed since, are parsed
+    '''
+    stored = read_store(store_path)
+    store = {}
+    columns = []
+    n_parsed = 0
+    for sample, assembler, path in runs:
+        key = str(path)
+        mtime = os.stat(path).st_mtime_ns
+        if key in stored and stored[key][0] == mtime:
+            column = stored[key][1]
+        else:
+            column = read_krona_txt(path)
+            n_parsed += 1
+        store[key] = (mtime, column)
+        columns.append((sample, assembler, column))
+    print("Parsed {} new or changed of {} tables".format(n_parsed, len(runs)))
+    write_store(store, store_path)
+    return columns
+
+
+def write_cohort(columns, prefix):
+    lineages = sorted(set(l for _, _, column in columns for l in column))
+    lineage_ids = {l: i for i, l in enumerate(lineages)}
+    with open(str(prefix) + '.lineages.tsv', 'w') as fout:
+        fout.write('lineage_id\tlineage\n')
+        for i, lineage in enumerate(lineages):
+            fout.write('{}\t{}\n'.format(i, '\t'.join(lineage)))
+    with open(str(prefix) + '.counts.tsv', 'w') as fout:
+        fout.write('lineage_id\tsample\tassembler\tcount\n')
+        for sample, assembler, column in columns:
+            for i, count in sorted((lineage_ids[l], c) for l, c in column.items()):
+                fout.write('{}\t{}\t{}\t{}\n'.format(i, sample, assembler, count))
+    return len(lineages)
+
+
+def kept_lineages(columns, top=0, min_fraction=0.):
+    '''
+    Lineages among the top N and with at least min_fraction of the counts
+    of some sample. None if nothing is pruned
+    '''
+    if top <= 0 and min_fraction <= 0:
+        return None
+    kept = set()
+    for _, _, column in columns:
+        total = sum(column.values())
+        ranked = sorted(column.items(), key=lambda lc: lc[1], reverse=True)
+        if top > 0:
+            ranked = ranked[:top]
+        kept.update(
+                l for l, c in ranked
+                if total and c / total >= min_fraction
+                )
+    return kept
+
+
+def prune(column, kept_prefixes):
+    '''
+    Move the counts of lineages not kept to their closest ancestor that
+    is kept, or leads to a kept lineage. Totals do not change
+    '''
+    pruned = {}
+    for lineage, count in column.items():
+        target = lineage
+        while target not in kept_prefixes and len(target) > 1:
+            target = target[:-1]
+        pruned[target] = pruned.get(target, 0) + count
+    return pruned
+
+
+def write_krona_inputs(columns, krona_dir, kept=None):
+    kept_prefixes = set()
+    if kept is not None:
+        kept_prefixes = set(l[:i] for l in kept for i in range(1, len(l) + 1))
+
+    inputs = {}
+    for sample, assembler, column in columns:
+        if kept is not None:
+            column = prune(column, kept_prefixes)
+        krona_txt = krona_dir / Path(assembler) / Path(sample + '.krona.txt')
+        krona_txt.parent.mkdir(parents=True, exist_ok=True)
+        with open(krona_txt, 'w') as fout:
+            for lineage, count in column.items():
+                fout.write('{}\t{}\n'.format(count, '\t'.join(lineage)))
+        inputs.setdefault(assembler, []).append((krona_txt, sample))
+
+    # ktImportText takes file,name for every dataset
+    for assembler, files in inputs.items():
+        with open(krona_dir / Path(assembler + '.inputs.txt'), 'w') as fout:
+            for krona_txt, sample in files:
+                fout.write('{},{}\n'.format(krona_txt, sample))
+
+
+def main():
+    args = parse_arguments()
+
+    runs = read_runs_manifest(args.manifest)
+    args.prefix.parent.mkdir(parents=True, exist_ok=True)
+    store = args.store
+    if store is None:
+        store = Path(str(args.prefix) + '.store.pkl')
+
+    columns = load_columns(runs, store)
+    n_lineages = write_cohort(columns, args.prefix)
+    kept = kept_lineages(columns, top=args.top, min_fraction=args.min_fraction)
+    if kept is not None:
+        print("Keeping {} of {} lineages".format(len(kept), n_lineages))
+    write_krona_inputs(columns, args.krona_dir, kept)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+'''
+Helpers shared by cat_to_krona.py and rat_to_krona.py
+'''
+
+from contextlib import redirect_stdout
+from pathlib import Path
+
+
+def read_manifest(manifest_tsv, n_cols):
+    '''
+    Read a tab separated manifest of input/output paths for batch mode.
+    Lines starting with '#' are skipped. Every line must have at least two
+    columns (input, output), optional extra columns up to n_cols are
+    returned as None when missing.
+    '''
+    jobs = []
+    with open(manifest_tsv, 'r') as fin:
+        for line_no, line in enumerate(fin, start=1):
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = [f.strip() for f in line.rstrip('\n').split('\t')]
+            if len(fields) < 2 or len(fields) > n_cols:
+                raise ValueError(
+                        "{}:{}: expected 2 to {} columns, found {}".format(
+                            manifest_tsv, line_no, n_cols, len(fields))
+                        )
+            fields += [None] * (n_cols - len(fields))
+            jobs.append(
+                    [Path(f).resolve() if f else None for f in fields]
+                    )
+    return jobs
+
+
+def run_batch(jobs, convert):
+    '''
+    Call convert(*job) for every manifest entry. Anything it prints goes to
+    the entry's report file (third column) when given, else to stdout.
+    '''
+    for job in jobs:
+        report = job[2] if len(job) > 2 else None
+        job[1].parent.mkdir(parents=True, exist_ok=True)
+        if report is None:
+            convert(*job[:2])
+        else:
+            report.parent.mkdir(parents=True, exist_ok=True)
+            with open(report, 'w') as fout, redirect_stdout(fout):
+                convert(*job[:2])
+
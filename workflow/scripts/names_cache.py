@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+'''
+Persistent binary cache of the scientific names in NCBI's names.dmp
+
+The cache is a single file laid out as
+
+    header | sorted taxids (int64) | name offsets (uint64) | utf-8 name blob
+
+so it can be memory-mapped and queried with a binary search, without
+parsing anything. The header records the size, mtime and a digest of the
+names.dmp it was built from. A stale cache is rebuilt transparently.
+'''
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from compressed_io import open_input
+
+
+MAGIC = b'BANAMES1'
+# magic, no. of names, blob size, source size, source mtime (ns), source digest
+HEADER = struct.Struct('=8sQQQq20s4x')
+# Bytes of names.dmp read at a time for the digest
+DIGEST_CHUNK = 16 * 1024**2
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Build a binary cache of the scientific names in "
+            "names.dmp, shared by cat_to_krona.py and rat_to_krona.py"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-n",
+            "--names-dmp",
+            dest="names_dmp",
+            help="The names.dmp file available from NCBI Taxonomy. This "
+            "should be included in the CAT_taxonomy.<timestamp> directory",
+            required=True,
+            type=lambda p: Path(p).resolve(strict=True)
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Where to write the cache",
+            dest="output",
+            required=True,
+            )
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def default_cache_path(names_dmp):
+    return Path('{}.cache'.format(names_dmp))
+
+
+def source_key(names_dmp):
+    '''
+    Size, mtime and a digest of the whole names.dmp
+    '''
+    st = os.stat(names_dmp)
+    digest = hashlib.sha1(str(st.st_size).encode())
+    with open(names_dmp, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(DIGEST_CHUNK), b''):
+            digest.update(chunk)
+    return st.st_size, st.st_mtime_ns, digest.digest()
+
+
+def parse_official_names(names_dmp):
+    '''
+    Get the scientific names for the numeric taxids
+    '''
+    tax_dic = {}
+    with open_input(names_dmp) as fin:
+        for line in fin:
+            # Cheap check before splitting, most lines are not needed
+            if 'scientific name' not in line:
+                continue
+            fields = [f.strip() for f in line.split('|')]
+            if fields[3] == 'scientific name':
+                tax_dic[int(fields[0])] = fields[1]
+    return tax_dic
+
+
+def build_cache(names_dmp, cache_path):
+    '''
+    Parse names.dmp and write the cache atomically
+    '''
+    size, mtime_ns, digest = source_key(names_dmp)
+    tax_dic = parse_official_names(names_dmp)
+
+    taxids = array('q', sorted(tax_dic))
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for taxid in taxids:
+        blob += tax_dic[taxid].encode('utf-8')
+        offsets.append(len(blob))
+
+    header = HEADER.pack(
+            MAGIC, len(taxids), len(blob), size, mtime_ns, digest)
+
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write next to the target and rename, so that concurrent jobs never
+    # see a half-written cache
+    fd, tmp_path = tempfile.mkstemp(
+            dir=cache_path.parent, prefix=cache_path.name + '.')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(header)
+            taxids.tofile(fout)
+            offsets.tofile(fout)
+            fout.write(blob)
+        # mkstemp creates the file 0600
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, cache_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+class NamesCache:
+    '''
+    Read-only, dict-like view of a names cache. Keys are taxids, either as
+    int or as the str found in CAT lineages.
+    '''
+
+    def __init__(self, cache_path):
+        with open(cache_path, 'rb') as fin:
+            self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.magic, self.n_names, blob_size,
+            self.source_size, self.source_mtime_ns,
+            self.source_digest) = HEADER.unpack_from(self._mm)
+
+        if self.magic != MAGIC:
+            raise ValueError("{} is not a names cache".format(cache_path))
+
+        start = HEADER.size
+        view = memoryview(self._mm)
+        self._taxids = view[start:start + 8 * self.n_names].cast('q')
+        start += 8 * self.n_names
+        self._offsets = view[start:start + 8 * (self.n_names + 1)].cast('Q')
+        start += 8 * (self.n_names + 1)
+        self._blob = view[start:start + blob_size]
+        # Lineages repeat the same few thousand taxids over and over
+        self._seen = {}
+
+    def is_fresh(self, names_dmp):
+        st = os.stat(names_dmp)
+        if st.st_size != self.source_size:
+            return False
+        if st.st_mtime_ns == self.source_mtime_ns:
+            return True
+        # Touched or copied, but possibly the same content. The whole file
+        # is hashed, an edit of the same size can be anywhere in it
+        return source_key(names_dmp)[2] == self.source_digest
+
+    def _index(self, taxid):
+        try:
+            key = int(taxid)
+        except ValueError:
+            return -1
+        i = bisect_left(self._taxids, key)
+        if i < self.n_names and self._taxids[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, taxid):
+        try:
+            return self._seen[taxid]
+        except KeyError:
+            pass
+        i = self._index(taxid)
+        if i < 0:
+            raise KeyError(taxid)
+        name = str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+        self._seen[taxid] = name
+        return name
+
+    def __contains__(self, taxid):
+        return taxid in self._seen or self._index(taxid) >= 0
+
+    def __len__(self):
+        return self.n_names
+
+    def get(self, taxid, default=None):
+        try:
+            return self[taxid]
+        except KeyError:
+            return default
+
+    def close(self):
+        for view in (self._taxids, self._offsets, self._blob):
+            view.release()
+        self._mm.close()
+
+
+def load_official_names(names_dmp, cache_path=None):
+    '''
+    Load the names cache for names_dmp, (re)building it if it is missing
+    or stale
+    '''
+    if cache_path is None:
+        cache_path = default_cache_path(names_dmp)
+
+    if Path(cache_path).exists():
+        try:
+            names = NamesCache(cache_path)
+        except (ValueError, struct.error):
+            names = None
+        if names is not None and names.is_fresh(names_dmp):
+            return names
+        if names is not None:
+            names.close()
+
+    build_cache(names_dmp, cache_path)
+    return NamesCache(cache_path)
+
+
+def main():
+    args = parse_arguments()
+    names = load_official_names(args.names_dmp, args.output)
+    print("Cached {} names in {}".format(len(names), args.output))
+
+
+if __name__ == '__main__':
+    main()
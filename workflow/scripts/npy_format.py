@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+Write numpy .npy and .npz files without numpy
+
+For the scripts running in environments without numpy. Arrays are 1-d
+array.array or lists of str, or bytes for a 0-d byte string. The files
+load with numpy.load, and scipy.sparse.load_npz when laid out as it
+expects.
+'''
+
+from array import array
+import struct
+import sys
+import zipfile
+
+
+def npy_descr(values):
+    '''
+    numpy dtype string of values
+    '''
+    if isinstance(values, bytes):
+        return '|S{}'.format(max(1, len(values)))
+    if isinstance(values, array):
+        if values.typecode in 'fd':
+            kind = 'f'
+        elif values.typecode in 'bhilq':
+            kind = 'i'
+        else:
+            kind = 'u'
+        return '<{}{}'.format(kind, values.itemsize)
+    width = max([len(v) for v in values] + [1])
+    return '<U{}'.format(width)
+
+
+def npy_bytes(values):
+    '''
+    Contents of a .npy (format version 1.0) of values
+    '''
+    descr = npy_descr(values)
+    if isinstance(values, bytes):
+        shape = '()'
+        data = values.ljust(int(descr[2:]), b'\x00')
+    elif isinstance(values, array):
+        shape = '({},)'.format(len(values))
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+    else:
+        shape = '({},)'.format(len(values))
+        width = int(descr[2:])
+        data = ''.join(v.ljust(width, '\x00') for v in values).encode('utf-32-le')
+
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+            descr, shape)
+    # Magic, version and header length take 10 bytes. Data starts 64 byte
+    # aligned
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header + data
+
+
+def write_npy(path, values):
+    with open(path, 'wb') as fout:
+        fout.write(npy_bytes(values))
+
+
+def write_npz(path, arrays):
+    '''
+    Write a dict of name -> values as a compressed .npz, as
+    numpy.savez_compressed does
+    '''
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zout:
+        for name, values in arrays.items():
+            zout.writestr(name + '.npy', npy_bytes(values))
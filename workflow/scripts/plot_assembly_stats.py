@@ -3,12 +3,16 @@
 import argparse
 from pathlib import Path
 import datetime
+import numpy as np
 
 from bokeh.plotting import figure
 from bokeh.models import ColumnDataSource, DatetimeTickFormatter, HoverTool
 from bokeh.resources import CDN
 from bokeh.embed import file_html
 
+from compressed_io import open_input
+from resource_series import read_series
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
             description="Plot runtime stats for assemblers"
@@ -24,7 +28,8 @@ def parse_arguments():
             type=lambda p: Path(p).resolve(strict=True), 
             dest='data_dir',
             required=True,
-            help="Directory containing [assembler].[mem|time].txt files"
+            help="Directory containing [assembler]/[assembler].time.txt and "
+            "[assembler]/[assembler].usage.bin files"
             )
 
     requiredArgs.add_argument(
@@ -61,7 +66,7 @@ def parse_time_info(time_txt):
     '''
     Get maximum mem and duration from the time file
     '''
-    with open(time_txt, 'r') as fin:
+    with open_input(time_txt) as fin:
         fields = fin.readline().split()
     # Convert to a datetime object
     runtime =  datetime.datetime.strptime(fields[0], "%H:%M:%S") 
@@ -76,79 +81,131 @@ def parse_time_info(time_txt):
     return duration, max_mem
 
 
-def is_core_cmd(command_string):
-    cmd_binary = command_string.split('/')[-1]
-    
-    if cmd_binary in ['spades-core', 'megahit_core']:
-        return True
-    else:
-        return False
+# Plots start at an arbitrary date, only the elapsed time is shown
+PLOT_START = np.datetime64('2021-05-01T00:00:00')
+
+# Every line of a ps log is either a `date +%T` stamp or a ps line,
+# '  PID USER  RSS COMMAND'. The log loop's own grep shows up as a process
+NEWLINE = ord('\n')
+SPACE = ord(' ')
+COLON = ord(':')
+ZERO = ord('0')
+GREP = b'grep '
+
+# More digits than any RSS in KB
+MAX_DIGITS = 16
+
+
+def is_digit(chars):
+    return (chars - np.uint8(ZERO)) < 10
 
 
 def parse_mem_txt(mem_txt):
-    
+    '''
+    Get the memory usage over time from the ps log of runs from before
+    resource_sampler.py. The log is split in lines and tokens with numpy
+    passes over the whole buffer, and only the bytes of the stamps and the
+    RSS are read per line. The RSS of all processes listed at a stamp is
+    summed. Elapsed time is taken from the stamps, rolling over at
+    midnight.
+    '''
+    with open_input(mem_txt, 'rb') as fin:
+        chars = np.frombuffer(fin.read() or b'\n', dtype=np.uint8)
+
+    def at(pos, offset=0):
+        # Reads past the end give the last byte
+        return np.take(chars, pos + offset, mode='clip')
+
+    # Tokens start where whitespace is followed by anything else
+    is_sep = chars <= SPACE
+    is_start = np.empty(len(chars), dtype=bool)
+    is_start[:1] = ~is_sep[:1]
+    np.greater(is_sep[:-1], is_sep[1:], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    line_starts = np.flatnonzero(chars == NEWLINE) + 1
+    line_ends = np.append(line_starts - 1, len(chars))
+    line_starts = np.insert(line_starts, 0, 0)
+
+    is_stamp = at(line_starts, 2) == COLON
+    is_stamp &= (at(line_starts, 5) == COLON) & is_digit(at(line_starts))
+    # Lines before the first stamp belong to no tick
+    tick = np.cumsum(is_stamp) - 1
+
+    stamps = line_starts[is_stamp]
+    hms = [at(stamps, i).astype(np.int64) - ZERO for i in (0, 1, 3, 4, 6, 7)]
+    seconds = ((hms[0] * 10 + hms[1]) * 3600
+            + (hms[2] * 10 + hms[3]) * 60
+            + hms[4] * 10 + hms[5])
+    rollovers = np.concatenate([[0], np.cumsum(np.diff(seconds) < 0)])
+    seconds = seconds + 24 * 3600 * rollovers
+    if len(seconds):
+        seconds -= seconds[0]
+
+    # PID, RSS and command are the first, third and fourth token of a ps
+    # line, the header has no digits there
+    lines = np.flatnonzero(~is_stamp & (tick >= 0))
+    first = np.searchsorted(starts, line_starts[lines])
+    starts = np.append(starts, [len(chars)] * 4)
+    pid, rss, command = starts[first], starts[first + 2], starts[first + 3]
+    ends = line_ends[lines]
+    is_proc = (rss < ends) & is_digit(at(pid)) & is_digit(at(rss))
+    is_grep = (command < ends) & (at(command) == GREP[0])
+    for i in range(1, len(GREP)):
+        is_grep[is_grep] = at(command[is_grep], i) == GREP[i]
+    is_proc &= ~is_grep
+    lines, rss = lines[is_proc], rss[is_proc]
+
+    # One digit of all RSS at a time, until every number has ended
+    rss_kb = np.zeros(len(rss), dtype=np.int64)
+    in_number = np.ones(len(rss), dtype=bool)
+    for i in range(MAX_DIGITS):
+        digits = at(rss, i)
+        in_number &= is_digit(digits)
+        if not in_number.any():
+            break
+        rss_kb = np.where(in_number, rss_kb * 10 + digits - ZERO, rss_kb)
+
+    mem = np.bincount(
+            tick[lines], weights=rss_kb, minlength=len(seconds)
+            ) / 1024**2
+
     dic = {
-            'timepoints': [],
-            'tstamps': [],
-            'mem': []
+            'timepoints': np.arange(len(seconds)),
+            'seconds': seconds.astype(np.float64),
+            'tstamps': PLOT_START + (seconds * 1000).astype('timedelta64[ms]'),
+            'mem': mem,
           }
+    return dic
 
 
-    with open(mem_txt, 'r') as fin:
-        # using proper datetime objects for easier plotting
-        # Start is arbitrary
-        start = datetime.datetime(
-                year=2021, month=5, day=1, hour=0, minute=0, second = 0)
-        timepoint = 0
-        seconds = 0.0
-        for line in fin:
-            fields = line.split()
-            if len(fields) == 1:
-                # Time 0 - the core job hasn't been submitted yet
-                if len(dic['timepoints']) == 0:
-                    dic['timepoints'].append(timepoint)
-                    dic['tstamps'].append(start)
-                    dic['mem'].append(0.)
-            # The actual command is this
-            elif is_core_cmd(fields[3]) is True:
-                # Increment the seconds
-                seconds += 60.
-                run_minute = start + datetime.timedelta(seconds=seconds)
-                dic['tstamps'].append(run_minute)
-
-                # Increment the index
-                timepoint += 1
-                dic['timepoints'].append(timepoint)
-
-                # Calculate Memory in GB
-                rss = int(fields[2]) / 1024**2                
-                dic['mem'].append(rss)
-            else:
-                #print(fields)
-                pass
-
+def parse_usage_bin(usage_bin):
+    '''
+    Get the memory usage over time from resource_sampler.py's series
+    '''
+    records, interval, start_epoch = read_series(usage_bin)
+    seconds = records['t'].astype(np.float64)
+    dic = {
+            'timepoints': np.arange(len(records)),
+            'seconds': seconds,
+            'tstamps': PLOT_START + (seconds * 1000).astype('timedelta64[ms]'),
+            'mem': records['rss'] / 1024**3,
+          }
     return dic
 
 
-def runstats_plot(plot_data):
+def parse_usage(assembler_dir, assembler):
+    '''
+    Read the sampled series, or the ps log of runs from before the sampler
+    '''
+    usage_bin = assembler_dir / Path("{}.usage.bin".format(assembler))
+    if usage_bin.exists():
+        return parse_usage_bin(usage_bin)
+    return parse_mem_txt(assembler_dir / Path("{}.mem.txt".format(assembler)))
 
-    sample_id = plot_data['sample_id']
-    metaspades_data = plot_data['metaspades']
-    metaspades_source = ColumnDataSource(
-            data={
-                'tstamps': metaspades_data['tstamps'],
-                'mem' :  metaspades_data['mem']
-                }
-            )
 
-    megahit_data=plot_data['megahit']
-    megahit_source = ColumnDataSource(
-            data={
-                'tstamps': megahit_data['tstamps'],
-                'mem' : megahit_data['mem']
-                }
-            )
+def runstats_plot(plot_data):
 
+    sample_id = plot_data['sample_id']
 
     p = figure(title="Sample: {}".format(sample_id),
         x_axis_type="datetime",
@@ -163,37 +220,28 @@ def runstats_plot(plot_data):
             ]
         )
 
-    p.circle(x=metaspades_data['tstamps'],
-            y=metaspades_data['mem'],
-            line_color=colors['metaspades']['circle'],
-            fill_color=colors['metaspades']['circle'],
-            name='metaspades_circles'
-            )
-
-    p.line(x='tstamps',
-            y='mem',
-            source = metaspades_source,
-            legend_label='metaspades',
-            line_width=2,
-            line_color=colors['metaspades']['line'],
-            line_alpha=0.8
-            )
-
-    p.circle(x=megahit_data['tstamps'],
-            y=megahit_data['mem'],
-            line_color=colors['megahit']['circle'],
-            fill_color=colors['megahit']['circle'],
-            name='megahit_circles'
-            )
-
-    p.line(x='tstamps',
-            y='mem',
-            source = megahit_source,
-            legend_label='megahit',
-            line_width=2,
-            line_color=colors['megahit']['line'],
-            line_alpha=0.8
-            )
+    hover_names = []
+    for assembler in colors:
+        if assembler not in plot_data:
+            continue
+        data = plot_data[assembler]
+        source = ColumnDataSource(
+                data={
+                    'x': data['tstamps'],
+                    'y': data['mem']
+                    }
+                )
+
+        p.line(x='x',
+                y='y',
+                source = source,
+                legend_label=assembler,
+                line_width=2,
+                line_color=colors[assembler]['line'],
+                line_alpha=0.8,
+                name='{}_line'.format(assembler)
+                )
+        hover_names.append('{}_line'.format(assembler))
 
     p.xaxis[0].formatter = DatetimeTickFormatter(
         minutes="%M:%S",
@@ -204,10 +252,7 @@ def runstats_plot(plot_data):
 
     p.add_layout(p.legend[0],'right')
     hover_tool = p.select(type=HoverTool)
-    hover_tool.names = [
-            "metaspades_circles",
-            "megahit_circles"
-            ]
+    hover_tool.names = hover_names
     hover_tool.formatters= { "@x" : "datetime"}
 
     return p
@@ -217,32 +262,18 @@ if __name__ == '__main__':
     
     sample_id = get_sample_id(args.data_dir)
 
-    metaspades_mem_txt = args.data_dir / Path("metaspades.mem.txt")
-    metaspades_time_txt = args.data_dir / Path("metaspades.time.txt")
-    metaspades_duration, metaspades_max_mem = parse_time_info(metaspades_time_txt)
-
-    megahit_mem_txt = args.data_dir / Path("megahit.mem.txt")
-    megahit_time_txt=args.data_dir / Path("megahit.time.txt")
-    megahit_duration, megahit_max_mem = parse_time_info(megahit_time_txt)
-
-    metaspades_data = parse_mem_txt(metaspades_mem_txt)
-    megahit_data = parse_mem_txt(megahit_mem_txt)
-
-    metaspades_data['duration'] = metaspades_duration
-    metaspades_data['max_mem'] = metaspades_max_mem
-
-    megahit_data['duration'] = megahit_duration
-    megahit_data['max_mem'] = megahit_max_mem
-
-    plot_data = {
-            'sample_id': sample_id,
-            'megahit': megahit_data,
-            'metaspades': metaspades_data
-            }
+    plot_data = {'sample_id': sample_id}
+    for assembler in colors:
+        assembler_dir = args.data_dir / Path(assembler)
+        time_txt = assembler_dir / Path("{}.time.txt".format(assembler))
+        if not time_txt.exists():
+            continue
+        duration, max_mem = parse_time_info(time_txt)
+        data = parse_usage(assembler_dir, assembler)
+        data['duration'] = duration
+        data['max_mem'] = max_mem
+        plot_data[assembler] = data
     
     runstats_plot = runstats_plot(plot_data)
     runstats_html = file_html(runstats_plot, CDN, '{}_runstats'.format(sample_id))
     args.out_html.write_text(runstats_html)
-
-
-
@@ -2,11 +2,44 @@
 
 import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+import matplotlib
 import seaborn as sns
 import pandas as pd
 import matplotlib.pyplot as plt
 
 
+FORMATS = ['png', 'pdf', 'svg', 'eps']
+
+VARIABLES = {
+    's' : 'Runtime (seconds)',
+    'max_rss': 'Memory usage - RSS (MB)',
+    'io_out' : 'Output written (MB)',
+    'cpu_time' : 'Total CPU time'
+}
+
+RULE_ORDER = [
+    'quast',
+    'assembly_stats',
+    'bwa_index',
+    'bwa_mem',
+    'samtools_flagstat',
+    'samtools_stats',
+    'filter_bam',
+    'map_fused',
+    'filter',
+    'cat_contigs',
+    'cat_names',
+    'cat_summary'
+]
+
+DPI = 300
+
+
 def parse_arguments():
     parser=argparse.ArgumentParser(
             description="Plot s, max_rss, io_out per sample group."
@@ -34,68 +67,133 @@ def parse_arguments():
             dest="output",
             required=True,
             )
-    
+
+    optionalArgs.add_argument(
+            "-f",
+            "--formats",
+            nargs="+",
+            choices=FORMATS,
+            default=FORMATS,
+            dest="formats",
+            help="Figure formats to produce [default = all]"
+            )
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=4,
+            dest="threads",
+            help="Number of figures rendered in parallel [default = 4]"
+            )
+    optionalArgs.add_argument(
+            "--cache-dir",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="cache_dir",
+            help="Rendered figures are kept here, keyed by a hash of their "
+            "data and plot parameters, and reused when nothing changed "
+            "[default = <output>/.cache]"
+            )
 
     parser._action_groups.append(optionalArgs)
 
     return parser.parse_args()
 
 
-
-def plot(data, output_dir, formats=['png','pdf', 'svg', 'eps']):
-    variables = {
-        's' : 'Runtime (seconds)',
-        'max_rss': 'Memory usage - RSS (MB)',
-        'io_out' : 'Output written (MB)',
-        'cpu_time' : 'Total CPU time'
-    }
-
-    rule_order= [
-        'quast', 
-        'bwa_index', 
-        'bwa_mem', 
-        'samtools_flagstat', 
-        'samtools_stats', 
-        'filter', 
-        'cat_contigs', 
-        'cat_names', 
-        'cat_summary'
-    ]
-
-    for var in variables:
-        with sns.color_palette('deep') as palette:
-            g = sns.catplot(
-                x='rule', y=var, 
-                hue='assembler', col='company', 
-                col_wrap = 1, 
-                kind = "box",
-                data=data,
-                palette={'metaspades': palette[0], 'megahit': palette[3]},
-                order=rule_order,
-                height=4, aspect=2, 
-                sharey=False,
+def figure_key(data_slice, var, fmt):
+    '''
+    Hash of everything that ends up in a figure
+    '''
+    digest = hashlib.sha256()
+    digest.update(
+            pd.util.hash_pandas_object(data_slice, index=False).values.tobytes()
             )
-            ax = plt.gca()
-            g.set_xticklabels(ax.get_xticklabels(), rotation=60)
-            g.set_titles(col_template="{col_name}", size=14)
-            g.set_ylabels(f'{variables.get(var)}', size=12)
-            g.set_xlabels('Rule', size=14)
-
-            for fmt in formats:
-                fout_base = f'{var}.{fmt}'
-                fout_path = output_dir / Path(fout_base)
-                g.fig.savefig(fout_path,
-                        dpi=300,
-                        bbox_inches='tight'
-                        )
+    digest.update(','.join(data_slice.columns).encode())
+    digest.update(json.dumps([
+        var, VARIABLES[var], RULE_ORDER, fmt, DPI,
+        sns.__version__, matplotlib.__version__
+        ]).encode())
+    return digest.hexdigest()[:16]
+
+
+def render(data, var, fmt, fout_path):
+    matplotlib.use('Agg')
+    with sns.color_palette('deep') as palette:
+        g = sns.catplot(
+            x='rule', y=var,
+            hue='assembler', col='company',
+            col_wrap = 1,
+            kind = "box",
+            data=data,
+            palette={'metaspades': palette[0], 'megahit': palette[3]},
+            order=RULE_ORDER,
+            height=4, aspect=2,
+            sharey=False,
+        )
+        ax = plt.gca()
+        g.set_xticklabels(ax.get_xticklabels(), rotation=60)
+        g.set_titles(col_template="{col_name}", size=14)
+        g.set_ylabels(f'{VARIABLES.get(var)}', size=12)
+        g.set_xlabels('Rule', size=14)
+
+        # Never leave a partial figure behind under its final name
+        tmp_path = fout_path.parent / Path(f'tmp-{fout_path.name}')
+        g.fig.savefig(tmp_path,
+                format=fmt,
+                dpi=DPI,
+                bbox_inches='tight'
+                )
+        plt.close(g.fig)
+        os.replace(tmp_path, fout_path)
+    return fout_path
+
+
+def plot(data, output_dir, formats=FORMATS, threads=4, cache_dir=None):
+    '''
+    Render one figure per metric and format, in parallel. Figures whose
+    data and parameters did not change are copied from the cache instead.
+    '''
+    if cache_dir is None:
+        cache_dir = output_dir / Path('.cache')
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    for var in VARIABLES:
+        data_slice = data[['rule', var, 'assembler', 'company']]
+        for fmt in formats:
+            cached = cache_dir / Path(
+                    f'{var}.{figure_key(data_slice, var, fmt)}.{fmt}')
+            fout_path = output_dir / Path(f'{var}.{fmt}')
+            jobs.append((data_slice, var, fmt, cached, fout_path))
+
+    to_render = [job for job in jobs if not job[3].exists()]
+    print("Rendering {} of {} figures".format(len(to_render), len(jobs)))
+    with ProcessPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = [
+                pool.submit(render, data_slice, var, fmt, cached)
+                for data_slice, var, fmt, cached, fout_path in to_render
+                ]
+        for future in futures:
+            future.result()
+
+    for data_slice, var, fmt, cached, fout_path in jobs:
+        # Drop figures of older data for the same metric and format
+        for stale in cache_dir.glob(f'{var}.*.{fmt}'):
+            if stale != cached:
+                stale.unlink()
+        shutil.copyfile(cached, fout_path)
+
 
 def main():
     args = parse_arguments()
 
     data = pd.read_csv(args.input_tsv, sep='\t', na_values='-')
-    plot(data, args.output)
+    plot(data, args.output,
+            formats=args.formats,
+            threads=args.threads,
+            cache_dir=args.cache_dir
+            )
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from bokeh.plotting import figure
+from bokeh.layouts import column, row
+from bokeh.models import (
+        ColumnDataSource, CDSView, IndexFilter,
+        CustomJS, MultiChoice, CheckboxGroup, Div
+        )
+from bokeh.palettes import Category10_10
+from bokeh.resources import CDN
+from bokeh.embed import file_html
+
+from plot_assembly_stats import parse_mem_txt, parse_usage_bin
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+            description="Plot the memory usage of all assembly runs in a "
+            "single interactive html"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "--manifest",
+            type=lambda p: Path(p).resolve(strict=True),
+            dest="manifest",
+            required=True,
+            help="A tab separated file with one run per line: sample, "
+            "assembler and the [assembler].usage.bin of the run. The ps log "
+            "([assembler].mem.txt) of older runs is also accepted"
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output-html",
+            type=lambda p: Path(p).resolve(),
+            required=True,
+            dest="out_html",
+            help="Save html in this file"
+            )
+    optionalArgs.add_argument(
+            "-a",
+            "--assemblers",
+            nargs="+",
+            dest="assemblers",
+            default=None,
+            help="Assemblers in the order they are listed and colored. Others "
+            "found in the manifest follow in order of appearance"
+            )
+    optionalArgs.add_argument(
+            "-p",
+            "--points",
+            type=int,
+            default=1000,
+            dest="points",
+            help="Maximum number of points drawn per run [default = 1000]"
+            )
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=1,
+            dest="threads",
+            help="Number of usage files read in parallel [default = 1]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def read_runs_manifest(manifest_tsv):
+    runs = []
+    with open(manifest_tsv, 'r') as fin:
+        for line_no, line in enumerate(fin, start=1):
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                raise ValueError(
+                        "{}:{}: expected 3 columns, found {}".format(
+                            manifest_tsv, line_no, len(fields))
+                        )
+            runs.append((fields[0], fields[1], Path(fields[2]).resolve()))
+    return runs
+
+
+def minmax_decimate(x, y, n_points):
+    '''
+    Reduce a series to at most ~n_points by keeping the minimum and the
+    maximum of y in equally sized chunks, in their original order. Peaks
+    survive, unlike with plain subsampling.
+    '''
+    n_chunks = n_points // 2
+    if len(x) <= n_points or n_chunks < 1:
+        return x, y
+    chunk = -(-len(x) // n_chunks)
+    n_full = len(x) // chunk
+    blocks = y[:n_full * chunk].reshape(n_full, chunk)
+    offsets = np.arange(n_full) * chunk
+    keep = [
+            offsets + blocks.argmin(axis=1),
+            offsets + blocks.argmax(axis=1),
+            [0, len(x) - 1]
+            ]
+    if n_full * chunk < len(x):
+        tail = y[n_full * chunk:]
+        keep.append([n_full * chunk + tail.argmin(), n_full * chunk + tail.argmax()])
+    keep = np.unique(np.concatenate(keep))
+    return x[keep], y[keep]
+
+
+def load_run(usage_file, n_points):
+    '''
+    Hours since start and memory (GB) of one run, decimated for display.
+    Also returns the peak memory, before decimation.
+    '''
+    if usage_file.suffix == '.bin':
+        data = parse_usage_bin(usage_file)
+    else:
+        data = parse_mem_txt(usage_file)
+    hours = data['seconds'] / 3600
+    mem = np.asarray(data['mem'], dtype=np.float64)
+    peak = float(mem.max()) if len(mem) else 0.
+    hours, mem = minmax_decimate(hours, mem, n_points)
+    return hours.astype(np.float32), mem.astype(np.float32), peak
+
+
+# Show only the selected runs. An empty sample selection means all samples
+FILTER_JS = '''
+const samples = new Set(sample_choice.value);
+const assemblers = new Set(
+    assembler_choice.active.map((i) => assembler_choice.labels[i]));
+const sample = runs.data['sample'];
+const assembler = runs.data['assembler'];
+const indices = [];
+for (let i = 0; i < sample.length; i++) {
+    if ((samples.size == 0 || samples.has(sample[i]))
+            && assemblers.has(assembler[i])) {
+        indices.push(i);
+    }
+}
+shown.indices = indices;
+runs.change.emit();
+'''
+
+
+def dashboard(runs, assemblers):
+    '''
+    One multi_line glyph for all runs. The sample and assembler filters
+    only change which rows of it are drawn, the data is embedded once
+    '''
+    colors = {
+            a: Category10_10[i % len(Category10_10)]
+            for i, a in enumerate(assemblers)
+            }
+    data = {
+            'xs': [r['hours'] for r in runs],
+            'ys': [r['mem'] for r in runs],
+            'sample': [r['sample'] for r in runs],
+            'assembler': [r['assembler'] for r in runs],
+            'peak': [r['peak'] for r in runs],
+            'color': [colors[r['assembler']] for r in runs],
+            }
+    runs_source = ColumnDataSource(data=data)
+    shown = IndexFilter(list(range(len(runs))))
+
+    p = figure(title="Memory usage of {} assembly runs".format(len(runs)),
+        x_axis_label="Runtime (hours)",
+        y_axis_label="Memory Usage (GB)",
+        sizing_mode="stretch_width",
+        height=600,
+        toolbar_location="below",
+        tools=["pan,wheel_zoom,box_zoom,hover,reset,save,help"],
+        tooltips= [
+            ("Sample", "@sample"),
+            ("Assembler", "@assembler"),
+            ("Peak memory (GB)", "@peak{0.00}"),
+            ]
+        )
+    p.multi_line(xs='xs', ys='ys',
+            source=runs_source,
+            view=CDSView(source=runs_source, filters=[shown]),
+            line_color='color',
+            line_width=1.5,
+            line_alpha=0.7,
+            hover_line_width=3,
+            hover_line_alpha=1.0
+            )
+
+    samples = sorted(set(data['sample']))
+    sample_choice = MultiChoice(
+            title="Samples (none selected shows all)",
+            options=samples,
+            value=[],
+            sizing_mode="stretch_width"
+            )
+    assembler_choice = CheckboxGroup(
+            labels=assemblers,
+            active=list(range(len(assemblers))),
+            inline=True
+            )
+    callback = CustomJS(
+            args=dict(
+                runs=runs_source,
+                shown=shown,
+                sample_choice=sample_choice,
+                assembler_choice=assembler_choice
+                ),
+            code=FILTER_JS
+            )
+    sample_choice.js_on_change('value', callback)
+    assembler_choice.js_on_change('active', callback)
+
+    legend = Div(text=' '.join(
+        '<span style="color:{}">&#9632; {}</span>'.format(colors[a], a)
+        for a in assemblers
+        ))
+
+    return column(
+            row(assembler_choice, legend),
+            sample_choice,
+            p,
+            sizing_mode="stretch_width"
+            )
+
+
+def main():
+    args = parse_arguments()
+
+    manifest_runs = read_runs_manifest(args.manifest)
+    # Given order first, anything else in the manifest after it
+    assemblers = list(dict.fromkeys(
+        (args.assemblers or []) + [r[1] for r in manifest_runs]
+        ))
+
+    with ProcessPoolExecutor(max_workers=max(1, args.threads)) as pool:
+        loaded = pool.map(
+                load_run,
+                [r[2] for r in manifest_runs],
+                [args.points] * len(manifest_runs)
+                )
+        runs = [
+                {
+                    'sample': sample,
+                    'assembler': assembler,
+                    'hours': hours,
+                    'mem': mem,
+                    'peak': peak
+                    }
+                for (sample, assembler, _), (hours, mem, peak)
+                in zip(manifest_runs, loaded)
+                ]
+
+    layout = dashboard(runs, assemblers)
+    html = file_html(layout, CDN, 'Assembly runtime stats')
+    args.out_html.parent.mkdir(parents=True, exist_ok=True)
+    args.out_html.write_text(html)
+
+
+if __name__ == '__main__':
+    main()
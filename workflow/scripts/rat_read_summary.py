@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+'''
+Summarise RAT's read2classification.txt without loading it
+
+The file is split in byte ranges, aligned to lines, that are tallied in
+parallel. A line belongs to the range it starts in. A compressed file is
+streamed through its decompressor instead. Only the counts per
+lineage and per contig are kept, so memory depends on the taxonomy and the
+assembly, not on the number of reads. Writes
+
+    <prefix>.lineages.tsv   reads per lineage as RAT reports it, and the
+                            number of complete.abundance.txt with -a
+    <prefix>.taxa.tsv       reads per taxid, of its own and of its clade
+    <prefix>.contigs.tsv    reads per contig
+    <prefix>.ranks.tsv      reads per taxid of every rank, with --nodes-dmp
+
+The lineage and contig columns are found by name in the header.
+'''
+
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
+
+from compressed_io import is_seekable, open_input
+from names_cache import load_official_names
+from taxonomy_trie import TaxonomyTrie, read_ranks
+
+
+RANKS = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus',
+        'species']
+# Lines read at a time by a worker
+BATCH_BYTES = 16 * 1024**2
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Tally the reads per lineage, taxid and contig of "
+            "RAT's read2classification.txt in parallel"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-i",
+            "--input",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="<prefix>.read2classification.txt produced by RAT",
+            dest="input",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output-prefix",
+            type=lambda p: Path(p).resolve(),
+            help="Prefix of the summary tables",
+            dest="prefix",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-n",
+            "--names-dmp",
+            dest="names_dmp",
+            help="names.dmp, to name the taxa of the summaries",
+            required=False,
+            type=lambda p: Path(p).resolve(strict=True),
+            default=None
+            )
+    optionalArgs.add_argument(
+            "--names-cache",
+            dest="names_cache",
+            help="Binary cache of names.dmp, built by names_cache.py "
+            "[default = <names.dmp>.cache]",
+            required=False,
+            type=lambda p: Path(p).resolve(),
+            default=None
+            )
+    optionalArgs.add_argument(
+            "--nodes-dmp",
+            dest="nodes_dmp",
+            help="nodes.dmp, to write the reads per rank",
+            required=False,
+            type=lambda p: Path(p).resolve(strict=True),
+            default=None
+            )
+    optionalArgs.add_argument(
+            "-a",
+            "--abundance",
+            dest="abundance",
+            help="complete.abundance.txt of the same RAT run, to compare the "
+            "reads per lineage with",
+            required=False,
+            type=lambda p: Path(p).resolve(strict=True),
+            default=None
+            )
+    optionalArgs.add_argument(
+            "--include-stars",
+            dest="include_stars",
+            action="store_true",
+            help="Count suggestive classifications, marked with '*', in the "
+            "taxa and ranks summaries [default = False]",
+            default=False,
+            )
+    optionalArgs.add_argument(
+            "--lineage-column",
+            type=int,
+            default=None,
+            dest="lineage_column",
+            help="1-based column of the lineage [default = from the header]"
+            )
+    optionalArgs.add_argument(
+            "--contig-column",
+            type=int,
+            default=None,
+            dest="contig_column",
+            help="1-based column of the contig [default = from the header]"
+            )
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=1,
+            dest="threads",
+            help="Parallel workers [default = 1]"
+            )
+    optionalArgs.add_argument(
+            "--chunk-mb",
+            type=int,
+            default=256,
+            dest="chunk_mb",
+            help="Size of the byte ranges tallied by a worker [default = 256]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def find_columns(read2classification):
+    '''
+    0-based lineage and contig columns, from the last '#' header line
+    before the data. None for those not found
+    '''
+    header = None
+    with open_input(read2classification) as fin:
+        for line in fin:
+            if not line.startswith('#'):
+                break
+            header = line.lstrip('#').rstrip('\n').split('\t')
+    if header is None:
+        return None, None
+
+    lineage_col = None
+    contig_col = None
+    for i, name in enumerate(h.strip().lower() for h in header):
+        if lineage_col is None and 'lineage' in name and 'score' not in name:
+            lineage_col = i
+        if contig_col is None and 'contig' in name:
+            contig_col = i
+    return lineage_col, contig_col
+
+
+def chunk_ranges(path, chunk_bytes):
+    size = os.path.getsize(path)
+    starts = list(range(0, size, max(1, chunk_bytes)))
+    return [(s, min(s + chunk_bytes, size)) for s in starts]
+
+
+def tally_lines(lines, lineages, contigs, lineage_col, contig_col):
+    '''
+    Add the reads of lines to the lineage and contig counters
+    '''
+    n_split = max(lineage_col, -1 if contig_col is None else contig_col) + 1
+    for line in lines:
+        if line.startswith(b'#'):
+            continue
+        fields = line.rstrip(b'\r\n').split(b'\t', n_split)
+        n_fields = len(fields)
+        lineages[fields[lineage_col] if lineage_col < n_fields else b''] += 1
+        if contig_col is not None and contig_col < n_fields:
+            contigs[fields[contig_col]] += 1
+
+
+def tally_chunk(path, start, end, lineage_col, contig_col):
+    '''
+    Reads per lineage and per contig of the lines starting in [start, end)
+    '''
+    lineages = Counter()
+    contigs = Counter()
+    with open(path, 'rb') as fin:
+        if start > 0:
+            # Skip the line started in the previous range. If start is at the
+            # beginning of a line, this only reads the newline before it
+            fin.seek(start - 1)
+            fin.readline()
+        pos = fin.tell()
+        while pos < end:
+            lines = fin.readlines(min(BATCH_BYTES, end - pos))
+            if not lines:
+                break
+            n_lines = 0
+            for line in lines:
+                n_lines += 1
+                pos += len(line)
+                if pos >= end:
+                    break
+            tally_lines(lines[:n_lines], lineages, contigs, lineage_col,
+                    contig_col)
+    return lineages, contigs
+
+
+def tally_stream(path, lineage_col, contig_col, threads=1):
+    '''
+    Reads per lineage and per contig of a compressed file, which can not be
+    read in byte ranges. It is decompressed in its own process, with
+    threads for bgzip
+    '''
+    lineages = Counter()
+    contigs = Counter()
+    with open_input(path, 'rb', threads) as fin:
+        while True:
+            lines = fin.readlines(BATCH_BYTES)
+            if not lines:
+                break
+            tally_lines(lines, lineages, contigs, lineage_col, contig_col)
+    return lineages, contigs
+
+
+def tally(path, lineage_col, contig_col, threads=1, chunk_bytes=256 * 1024**2):
+    if is_seekable(path):
+        lineages = Counter()
+        contigs = Counter()
+        ranges = chunk_ranges(path, chunk_bytes)
+        with ProcessPoolExecutor(max_workers=max(1, threads)) as pool:
+            futures = [
+                    pool.submit(tally_chunk, path, start, end, lineage_col,
+                        contig_col)
+                    for start, end in ranges
+                    ]
+            for future in futures:
+                chunk_lineages, chunk_contigs = future.result()
+                lineages.update(chunk_lineages)
+                contigs.update(chunk_contigs)
+    else:
+        lineages, contigs = tally_stream(path, lineage_col, contig_col, threads)
+    return (
+            {l.decode(): n for l, n in lineages.items()},
+            {c.decode(): n for c, n in contigs.items()}
+            )
+
+
+def is_lineage(value):
+    return value[:1].isdigit()
+
+
+def read_abundance_numbers(complete_abundance):
+    '''
+    Number of reads per lineage of a complete.abundance.txt
+    '''
+    numbers = {}
+    with open_input(complete_abundance) as fin:
+        for line in fin:
+            if not line.startswith('#'):
+                fields = [f.strip() for f in line.split('\t')]
+                numbers[fields[0]] = int(float(fields[1]))
+    return numbers
+
+
+def write_lineages(lineages, out_tsv, numbers=None):
+    n_diff = 0
+    with open(out_tsv, 'w') as fout:
+        if numbers is None:
+            fout.write('lineage\treads\n')
+        else:
+            fout.write('lineage\treads\tabundance_reads\n')
+        for lineage in sorted(set(lineages) | set(numbers or [])):
+            reads = lineages.get(lineage, 0)
+            if numbers is None:
+                fout.write('{}\t{}\n'.format(lineage, reads))
+                continue
+            number = numbers.get(lineage, 0)
+            n_diff += reads != number
+            fout.write('{}\t{}\t{}\n'.format(lineage, reads, number))
+    if numbers is not None:
+        print("{} lineages differ from the abundance table".format(n_diff))
+
+
+def name_of(trie, node):
+    if trie.tax_dic is None:
+        return ''
+    return trie.names(node)[-1]
+
+
+def write_taxa(trie, out_tsv, include_stars=False):
+    '''
+    Reads per taxid, classified to it and to its clade. Starred nodes are
+    merged with their plain equivalents
+    '''
+    totals = trie.rolled_up(include_stars=include_stars)
+    taxa = {}
+    for node in range(1, len(trie)):
+        if trie.is_starred(node) and not include_stars:
+            continue
+        own, clade = trie.counts[0][node], totals[node]
+        if not clade:
+            continue
+        taxid = trie.taxids[node]
+        if taxid in taxa:
+            own += taxa[taxid][0]
+            clade += taxa[taxid][1]
+        taxa[taxid] = (own, clade, name_of(trie, node))
+    with open(out_tsv, 'w') as fout:
+        fout.write('taxid\tname\treads\tclade_reads\n')
+        for taxid in sorted(taxa):
+            own, clade, name = taxa[taxid]
+            fout.write('{}\t{}\t{}\t{}\n'.format(taxid, name, own, clade))
+
+
+def write_ranks(trie, ranks, out_tsv, include_stars=False):
+    names = {}
+    for node in range(1, len(trie)):
+        names.setdefault(trie.taxids[node], name_of(trie, node))
+    with open(out_tsv, 'w') as fout:
+        fout.write('rank\ttaxid\tname\treads\n')
+        for rank in RANKS:
+            counts = trie.rank_counts(ranks, rank, include_stars=include_stars)
+            for taxid, reads in sorted(counts.items(), key=lambda tc: -tc[1]):
+                fout.write('{}\t{}\t{}\t{}\n'.format(
+                    rank, taxid, names[taxid], reads))
+
+
+def write_contigs(contigs, out_tsv):
+    with open(out_tsv, 'w') as fout:
+        fout.write('contig\treads\n')
+        for contig, reads in sorted(contigs.items()):
+            fout.write('{}\t{}\n'.format(contig, reads))
+
+
+def main():
+    args = parse_arguments()
+
+    lineage_col, contig_col = find_columns(args.input)
+    if args.lineage_column is not None:
+        lineage_col = args.lineage_column - 1
+    if args.contig_column is not None:
+        contig_col = args.contig_column - 1
+    if lineage_col is None:
+        raise ValueError(
+                "No lineage column in the header of {}, give it with "
+                "--lineage-column".format(args.input)
+                )
+    if contig_col is None:
+        print("No contig column in the header of {}, not counting reads "
+                "per contig".format(args.input))
+
+    lineages, contigs = tally(args.input, lineage_col, contig_col,
+            threads=args.threads,
+            chunk_bytes=args.chunk_mb * 1024**2
+            )
+    print("Tallied {} reads".format(sum(lineages.values())))
+
+    tax_dic = None
+    if args.names_dmp:
+        tax_dic = load_official_names(args.names_dmp, args.names_cache)
+    trie = TaxonomyTrie(tax_dic)
+    for lineage, reads in lineages.items():
+        if is_lineage(lineage):
+            trie.add(lineage, reads)
+
+    prefix = str(args.prefix)
+    args.prefix.parent.mkdir(parents=True, exist_ok=True)
+    numbers = None
+    if args.abundance:
+        numbers = read_abundance_numbers(args.abundance)
+    write_lineages(lineages, prefix + '.lineages.tsv', numbers)
+    write_taxa(trie, prefix + '.taxa.tsv', include_stars=args.include_stars)
+    write_contigs(contigs, prefix + '.contigs.tsv')
+    if args.nodes_dmp:
+        ranks = read_ranks(args.nodes_dmp, trie.taxids)
+        write_ranks(trie, ranks, prefix + '.ranks.tsv',
+                include_stars=args.include_stars)
+
+
+if __name__ == '__main__':
+    main()
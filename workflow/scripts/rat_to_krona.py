@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+from array import array
 from pathlib import Path
 
+from compressed_io import open_input
+from names_cache import load_official_names
+from krona_common import read_manifest, run_batch
+from npy_format import write_npz
+from taxonomy_trie import TaxonomyTrie
+
+
 def parse_arguments():
     parser=argparse.ArgumentParser(
             description="Create a ktImportText compatible file from RAT's "
@@ -14,22 +22,37 @@ def parse_arguments():
 
     requiredArgs = parser.add_argument_group("Required Arguments")
 
-    requiredArgs.add_argument(
+    ioArgs = parser.add_argument_group(
+            "Input/Output",
+            "Either -i and -o for a single sample or --manifest for many"
+            )
+
+    ioArgs.add_argument(
             "-i",
             "--input",
             type=lambda p: Path(p).resolve(strict=True),
             help="Path to the complete.abundance.txt file produced by RAT",
             dest="input",
-            required=True,
+            required=False,
             )
 
-    requiredArgs.add_argument(
+    ioArgs.add_argument(
             "-o",
             "--output",
             type=lambda p: Path(p).resolve(),
             help="Path to a tsv file suitable for ktImportText",
             dest="output",
-            required=True,
+            required=False,
+            )
+
+    ioArgs.add_argument(
+            "--manifest",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="A tab separated file with one sample per line: "
+            "complete.abundance.txt and output file. All samples are "
+            "converted in one go, loading names once",
+            dest="manifest",
+            required=False,
             )
 
     requiredArgs.add_argument(
@@ -42,6 +65,15 @@ def parse_arguments():
             type=lambda p: Path(p).resolve(strict=True)
             )
 
+    optionalArgs.add_argument(
+            "--names-cache",
+            dest="names_cache",
+            help="Binary cache of names.dmp, built by names_cache.py. It is "
+            "(re)built here if missing or stale [default = <names.dmp>.cache]",
+            required=False,
+            type=lambda p: Path(p).resolve(),
+            default=None
+            )
     optionalArgs.add_argument(
             "--include-stars",
             dest="include_stars",
@@ -61,25 +93,33 @@ def parse_arguments():
             help="Specify which counts to use [default='number']",
             required=False
             )
+    optionalArgs.add_argument(
+            "--matrix",
+            dest="matrix",
+            help="Also write all three count columns of all samples to this "
+            "compressed sparse lineage x sample matrix (.npz). Samples are "
+            "named after their output, without .krona.txt",
+            required=False,
+            type=lambda p: Path(p).resolve(),
+            default=None
+            )
 
     parser._action_groups.append(optionalArgs)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.manifest is None and (args.input is None or args.output is None):
+        parser.error("either -i and -o, or --manifest are required")
+    if args.manifest is not None and (args.input or args.output):
+        parser.error("--manifest can not be combined with -i/-o")
 
+    return args
 
 
-def parse_official_names(names_dmp):
-    '''
-    Get the scientific names for the numeric taxids 
-    '''
-    tax_dic = {}
-    with open(names_dmp, 'r') as fin:
-        for line in fin:
-            fields = [f.strip() for f in line.split('|')]
-            tax_id = fields[0]
-            if fields[3] == 'scientific name':
-                tax_dic[tax_id] = fields[1]
-    return tax_dic
+
+COUNT_COLUMNS = ['number', 'fraction', 'cor_fraction']
+# Rows of complete.abundance.txt that are not lineages
+SPECIAL_ROWS = ['unmapped', 'unclassified']
+
 
 def which_col_index(colname):
     try:
@@ -95,90 +135,164 @@ def which_col_index(colname):
         raise
         
 
-def is_star(lineage_string):
-    if '*' in lineage_string:
-        return True
-    else:
-        return False
+def to_number(fields, col_index, number_type=float):
+    if col_index >= len(fields) or not fields[col_index]:
+        return number_type(0)
+    return number_type(float(fields[col_index]))
 
 
-def translate_to_human_readable(lineage_string, tax_dic):
+def parse_complete_abundance_tsv(input_fp, trie):
     '''
-    Translate a numeric lineage string to human readable
+    Add all count columns of a complete.abundance.txt, (number, fraction,
+    cor_fraction), to trie. Returns those of the unmapped and unclassified
+    rows
     '''
-    human_tokens = []
-    for taxid in lineage_string.split(';'):
-        try:
-            taxname = tax_dic[taxid]
-            human_tokens.append(taxname)
-            human_string = ';'.join(human_tokens)
-        except:
-            print(lineage_string)
-            raise
-    return human_string
-
-def parse_complete_abundance_tsv(input_fp, 
-        tax_dic, 
-        col_index=1, 
-        include_stars=False
-        ):
-
-    stats = {}
-    with open(input_fp, 'r') as fin:
+    col_indices = [which_col_index(c) for c in COUNT_COLUMNS]
+    number_types = [int, float, float]
+
+    special = {}
+    with open_input(input_fp) as fin:
         for line in fin:
             if not line.startswith('#'):
                 fields = [f.strip() for f in line.split('\t')]
                 lineage = fields[0]
-                value = fields[col_index]
-                if lineage == 'unmapped':
-                    stats['unmapped'] = fields[1]
-                elif lineage == 'unclassified':
-                    stats['unclassified'] = fields[1]
-
-                elif (is_star(lineage) is True) and (include_stars is True):
-                    lineage_ = lineage.replace('*', '')
-                    hr_lineage = translate_to_human_readable(lineage_ , tax_dic)
-                    stats[hr_lineage] = value
-                elif (is_star(lineage) is True) and (include_stars is False):
-                    print("Skipping {}. No stars allowed".format(lineage))
-                    continue
+                values = [
+                        to_number(fields, i, t)
+                        for i, t in zip(col_indices, number_types)
+                        ]
+                if lineage in SPECIAL_ROWS:
+                    special[lineage] = tuple(values)
                 else:
-                    hr_lineage = translate_to_human_readable(lineage, tax_dic)
-                    stats[hr_lineage] = value
+                    trie.add(lineage, *values)
     
-    return stats
+    return special
 
 
 def write_stats_to_file(stats, output_fp):
     with open(output_fp, 'w') as fout:
         for lineage, value in stats.items():
-            lineage_string = '\t'.join(lineage.split(';'))
+            lineage_string = '\t'.join(lineage)
             fout.write('{}\t{}\n'.format(value, lineage_string))
 
 
 
-def main():
-    args = parse_arguments()
+def rat_to_krona(trie, special, output_fp, colname='number', include_stars=False):
+    '''
+    Write the counts of one complete.abundance.txt as a ktImportText table
+    '''
+    col = COUNT_COLUMNS.index(colname)
 
-    tax_dic = parse_official_names(args.names_dmp)
+    if include_stars is False:
+        for node in trie.nodes_with_counts():
+            if trie.is_starred(node):
+                print("Skipping {}. No stars allowed".format(
+                    trie.lineage_string(node)))
 
-    col_index = which_col_index(args.colname)
+    krona_stats = trie.krona_counts(col, include_stars=include_stars)
+    for lineage, values in special.items():
+        krona_stats[(lineage,)] = values[col]
 
-    stats = parse_complete_abundance_tsv(args.input,
-            tax_dic, 
-            col_index=col_index, 
-            include_stars=True
-            )
+    if ('root',) in krona_stats and ('unclassified',) in krona_stats:
+        krona_stats[('root',)] += krona_stats.pop(('unclassified',))
+
+    write_stats_to_file(krona_stats, output_fp)
 
-    if 'root' in stats:
-        if args.colname in ['fraction', 'cor_fraction']:
-            stats['root'] = float(stats['root']) + float(stats['unclassified'])
-        else:
-            stats['root'] = int(stats['root']) + int(stats['unclassified'])
 
-        stats.pop('unclassified')
+def sample_stats(trie, special, include_stars=False):
+    '''
+    All count columns of one sample per numeric lineage, without stars
+    '''
+    stats = dict(special)
+    for node in trie.nodes_with_counts():
+        if trie.is_starred(node) and include_stars is False:
+            continue
+        lineage = trie.lineage_string(node, stars=False)
+        values = tuple(counts[node] for counts in trie.counts)
+        if lineage in stats:
+            values = tuple(a + b for a, b in zip(stats[lineage], values))
+        stats[lineage] = values
+    return stats
+
+
+def write_matrix(samples, trie, matrix_fp):
+    '''
+    Write the counts of all samples, (name, stats) tuples, as a sparse
+    lineage x sample matrix in scipy's CSC layout. data holds the number
+    of reads, fraction and cor_fraction share its indices.
+    '''
+    lineages = sorted(set(l for _, stats in samples for l in stats))
+    row_of = {l: i for i, l in enumerate(lineages)}
+
+    indices = array('q')
+    indptr = array('q', [0])
+    columns = [array('q'), array('d'), array('d')]
+    for _, stats in samples:
+        for row, values in sorted((row_of[l], v) for l, v in stats.items()):
+            indices.append(row)
+            for column, value in zip(columns, values):
+                column.append(value)
+        indptr.append(len(indices))
+
+    write_npz(matrix_fp, {
+        'format': b'csc',
+        'shape': array('q', [len(lineages), len(samples)]),
+        'indices': indices,
+        'indptr': indptr,
+        'data': columns[0],
+        'fraction': columns[1],
+        'cor_fraction': columns[2],
+        'samples': [name for name, _ in samples],
+        'lineages': lineages,
+        'names': [
+            l if l in SPECIAL_ROWS else ';'.join(trie.names(trie.node(l)))
+            for l in lineages
+            ],
+        # -1 for unmapped and unclassified
+        'taxids': array('q', [
+            -1 if l in SPECIAL_ROWS else int(l.rpartition(';')[2])
+            for l in lineages
+            ]),
+        })
+
+
+def sample_name(output_fp):
+    '''
+    Name of a sample in the matrix, its output file without .krona.txt
+    '''
+    name = Path(output_fp).name
+    for suffix in ['.txt', '.krona']:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def main():
+    args = parse_arguments()
+
+    tax_dic = load_official_names(args.names_dmp, args.names_cache)
+    trie = TaxonomyTrie(tax_dic, typecodes='qdd')
+
+    samples = []
+    def convert(input_fp, output_fp):
+        trie.clear_counts()
+        special = parse_complete_abundance_tsv(input_fp, trie)
+        rat_to_krona(trie, special, output_fp,
+                colname=args.colname,
+                include_stars=args.include_stars
+                )
+        if args.matrix:
+            stats = sample_stats(trie, special,
+                    include_stars=args.include_stars)
+            samples.append((sample_name(output_fp), stats))
+
+    if args.manifest:
+        run_batch(read_manifest(args.manifest, 2), convert)
+    else:
+        convert(args.input, args.output)
 
-    write_stats_to_file(stats, args.output)
+    if args.matrix:
+        args.matrix.parent.mkdir(parents=True, exist_ok=True)
+        write_matrix(samples, trie, args.matrix)
 
 if __name__ == '__main__':
     main()
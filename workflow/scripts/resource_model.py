@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+'''
+Predict the peak memory and runtime of an assembly from its input size
+
+The model is a power law per assembler and metric,
+
+    log(y) = intercept + slope * log(input GB)
+
+fit on earlier runs in the aggregated benchmarks. Predictions add a
+margin above the fit: the larger of two residual standard deviations and
+the largest residual seen. Assemblers or metrics with too few runs get a
+conservative linear default.
+'''
+
+import argparse
+import json
+import math
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+# Fewer runs than this and the default is used
+MIN_RUNS = 3
+
+# Smallest input size considered, avoids log(0) for empty test files
+MIN_INPUT_GB = 0.01
+
+# Benchmark column: {assembler: (base, per input GB)}. max_rss is in MB,
+# s in seconds
+DEFAULTS = {
+        'max_rss': {
+            'metaspades': (16 * 1024, 16 * 1024),
+            'megahit': (4 * 1024, 4 * 1024),
+            },
+        's': {
+            'metaspades': (3600, 4 * 3600),
+            'megahit': (1800, 3600),
+            },
+        }
+
+
+# Never predict less than this, whatever the fit says
+FLOORS = {
+        'max_rss': 2048,
+        's': 600,
+        }
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Fit the peak memory and runtime of the assemblers "
+            "against their input size"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-b",
+            "--benchmarks",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="The aggregated benchmarks, as written by "
+            "concatenate_benchmarks.py",
+            dest="benchmarks_tsv",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-s",
+            "--samples",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="The samplesheet, with sample_id, R1 and R2 columns",
+            dest="samples_tsv",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Write the model to this json file",
+            dest="output",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-r",
+            "--rule",
+            default="assembly",
+            dest="rule",
+            help="Rule name of the assembly benchmarks [default = assembly]"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    return parser.parse_args()
+
+
+def input_size_gb(paths):
+    return sum(os.path.getsize(p) for p in paths) / 1024**3
+
+
+class ResourceModel:
+    '''
+    Fitted power laws, keyed by assembler and benchmark column
+    '''
+
+    def __init__(self, fits=None):
+        self.fits = fits or {}
+
+    @classmethod
+    def load(cls, model_json):
+        '''
+        Read a fitted model. A missing file gives the defaults only.
+        '''
+        if model_json is None or not Path(model_json).exists():
+            return cls()
+        with open(model_json, 'r') as fin:
+            return cls(json.load(fin))
+
+    def save(self, model_json):
+        with open(model_json, 'w') as fout:
+            json.dump(self.fits, fout, indent=2, sort_keys=True)
+            fout.write('\n')
+
+    def predict(self, assembler, metric, input_gb):
+        '''
+        Conservative estimate of metric for an input of input_gb. None if
+        there is neither a fit nor a default for the assembler.
+        '''
+        input_gb = max(input_gb, MIN_INPUT_GB)
+        fit = self.fits.get(assembler, {}).get(metric)
+        if fit is not None and fit['n'] >= MIN_RUNS:
+            predicted = math.exp(
+                    fit['intercept']
+                    + fit['slope'] * math.log(input_gb)
+                    + fit['margin']
+                    )
+        elif assembler in DEFAULTS[metric]:
+            base, per_gb = DEFAULTS[metric][assembler]
+            predicted = base + per_gb * input_gb
+        else:
+            return None
+        return max(predicted, FLOORS[metric])
+
+
+def fit_power_law(x, y, min_x=MIN_INPUT_GB):
+    '''
+    Least squares fit of log(y) on log(x). x is raised to min_x, in the
+    units of x, or points with x <= 0 are left out if min_x is None.
+    Returns None for fewer than MIN_RUNS points.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    if min_x is not None:
+        x = np.maximum(x, min_x)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & (x > 0) & np.isfinite(y) & (y > 0)
+    x, y = np.log(x[ok]), np.log(y[ok])
+    if len(x) < MIN_RUNS:
+        return None
+    if np.ptp(x) > 0:
+        slope, intercept = np.polyfit(x, y, 1)
+    else:
+        # All inputs the same size, nothing to scale with
+        slope, intercept = 0., y.mean()
+    residuals = y - (intercept + slope * x)
+    margin = max(2 * residuals.std(ddof=1), residuals.max(), 0.)
+    total = ((y - y.mean())**2).sum()
+    r2 = 1 - (residuals**2).sum() / total if total > 0 else 1.
+    return {
+            'intercept': float(intercept),
+            'slope': float(slope),
+            'margin': float(margin),
+            'r2': float(r2),
+            'n': int(len(x)),
+            }
+
+
+def fit_model(benchmarks, samples, rule='assembly'):
+    '''
+    Fit all assemblers and metrics in the benchmarks of rule, against the
+    size of the samples' current fastq files
+    '''
+    sizes = {}
+    for sample_id, r1, r2 in samples[['sample_id', 'R1', 'R2']].itertuples(index=False):
+        try:
+            sizes[sample_id] = input_size_gb([r1, r2])
+        except OSError:
+            print("Skipping {}, fastqs not found".format(sample_id))
+
+    runs = benchmarks[benchmarks['rule'] == rule].copy()
+    runs['input_gb'] = runs['sample_id'].map(sizes)
+    runs = runs.dropna(subset=['input_gb'])
+
+    fits = {}
+    for assembler, group in runs.groupby('assembler'):
+        for metric in DEFAULTS:
+            fit = fit_power_law(group['input_gb'], group[metric])
+            if fit is None:
+                print("{} {}: {} runs, using the default".format(
+                    assembler, metric, len(group)))
+                continue
+            fits.setdefault(assembler, {})[metric] = fit
+            print("{} {}: slope {:.2f} from {} runs".format(
+                assembler, metric, fit['slope'], fit['n']))
+    return ResourceModel(fits)
+
+
+def main():
+    args = parse_arguments()
+    benchmarks = pd.read_csv(args.benchmarks_tsv, sep='\t', na_values='-')
+    samples = pd.read_csv(args.samples_tsv, sep='\t')
+    model = fit_model(benchmarks, samples, rule=args.rule)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    model.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import os
+from pathlib import Path
+import signal
+import subprocess
+import sys
+import time
+import psutil
+
+from resource_series import SeriesWriter
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Run a command and record the resource usage of its "
+            "whole process tree. e.g. "
+            "resource_sampler.py -o usage.bin -- megahit -1 R1.fq -2 R2.fq"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-o",
+            "--output",
+            type=lambda p: Path(p).resolve(),
+            help="Binary time series of the resource usage. See "
+            "resource_series.py for the format",
+            dest="output",
+            required=True,
+            )
+    optionalArgs.add_argument(
+            "-i",
+            "--interval",
+            type=float,
+            default=0.5,
+            dest="interval",
+            help="Seconds between samples [default = 0.5]"
+            )
+    optionalArgs.add_argument(
+            "--uss-interval",
+            type=float,
+            default=10.,
+            dest="uss_interval",
+            help="Seconds between USS samples. USS is read from "
+            "/proc/<pid>/smaps, which is slow for processes with a large "
+            "memory footprint [default = 10]"
+            )
+    optionalArgs.add_argument(
+            "-b",
+            "--benchmark",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="benchmark",
+            help="Also write a summary of the run in the format of "
+            "snakemake's benchmark files"
+            )
+    optionalArgs.add_argument(
+            "--cgroup",
+            action="store_true",
+            dest="cgroup",
+            help="Run the command in its own cgroup v2 and take peak memory, "
+            "CPU time and I/O for --benchmark from the cgroup's accounting. "
+            "Falls back to the sampled process tree if no cgroup can be "
+            "created [default = False]"
+            )
+    optionalArgs.add_argument(
+            "--cgroup-parent",
+            type=lambda p: Path(p).resolve(strict=True),
+            default=None,
+            dest="cgroup_parent",
+            help="A delegated cgroup, writable by the user, with the memory, "
+            "cpu and io controllers enabled for its children, to create "
+            "the job's cgroup in [default = the cgroup of this process]"
+            )
+    requiredArgs.add_argument(
+            "command",
+            nargs=argparse.REMAINDER,
+            help="The command to run, after --"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error("no command given")
+
+    return args
+
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+
+
+class CgroupError(Exception):
+    pass
+
+
+def own_cgroup():
+    '''
+    The cgroup v2 directory this process belongs to, if any
+    '''
+    if not (CGROUP_ROOT / Path('cgroup.controllers')).exists():
+        return None
+    with open('/proc/self/cgroup', 'r') as fin:
+        for line in fin:
+            hierarchy, controllers, path = line.rstrip('\n').split(':', 2)
+            if hierarchy == '0' and controllers == '':
+                return CGROUP_ROOT / Path(path.lstrip('/'))
+    return None
+
+
+class JobCgroup:
+    '''
+    A cgroup v2 holding one job, created under parent. The kernel accounts
+    memory, CPU and I/O of every process in it, however deep the process
+    tree and however short-lived its members.
+    '''
+
+    def __init__(self, name, parent=None):
+        if parent is None:
+            parent = own_cgroup()
+        if parent is None:
+            raise CgroupError("cgroup v2 is not available")
+
+        try:
+            enabled = (parent / Path('cgroup.subtree_control')).read_text().split()
+            if 'memory' not in enabled or 'cpu' not in enabled:
+                # Only allowed if parent holds no processes itself
+                (parent / Path('cgroup.subtree_control')).write_text(
+                        '+memory +cpu +io')
+                enabled = (parent / Path('cgroup.subtree_control')).read_text().split()
+            self.path = parent / Path(name)
+            self.path.mkdir()
+        except OSError as e:
+            raise CgroupError(
+                    "can not create a cgroup in {}: {}".format(parent, e))
+        self.controllers = enabled
+
+    def enter(self):
+        '''
+        Move the calling process into the cgroup. Used as preexec_fn, so
+        that the command starts in it.
+        '''
+        with open(self.path / Path('cgroup.procs'), 'w') as fout:
+            fout.write('0')
+
+    def read_flat_keyed(self, name):
+        values = {}
+        with open(self.path / Path(name), 'r') as fin:
+            for line in fin:
+                key, value = line.split()
+                values[key] = int(value)
+        return values
+
+    def memory_peak(self):
+        '''
+        Peak memory charged to the cgroup, in bytes. This includes page
+        cache, not only RSS. memory.peak needs linux >= 5.19
+        '''
+        try:
+            return int((self.path / Path('memory.peak')).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def memory_current(self):
+        try:
+            return int((self.path / Path('memory.current')).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def cpu_seconds(self):
+        try:
+            return self.read_flat_keyed('cpu.stat')['usage_usec'] / 1e6
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def io_bytes(self):
+        '''
+        Bytes read and written to block devices, summed over devices
+        '''
+        if 'io' not in self.controllers:
+            return None
+        read_bytes = write_bytes = 0
+        try:
+            with open(self.path / Path('io.stat'), 'r') as fin:
+                for line in fin:
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition('=')
+                        if key == 'rbytes':
+                            read_bytes += int(value)
+                        elif key == 'wbytes':
+                            write_bytes += int(value)
+        except (OSError, ValueError):
+            return None
+        return read_bytes, write_bytes
+
+    def remove(self):
+        try:
+            # Leftovers, e.g. daemonized children of the job
+            if 'populated 1' in (self.path / Path('cgroup.events')).read_text():
+                (self.path / Path('cgroup.kill')).write_text('1')
+                time.sleep(0.1)
+            self.path.rmdir()
+        except OSError as e:
+            print("Could not remove cgroup {}: {}".format(self.path, e))
+
+
+class TreeSampler:
+    '''
+    Sum up the usage of a process and all its descendants.
+
+    CPU time and I/O of a process that exited are added to its parent by
+    the kernel once the parent reaps it. Until then they are missing from
+    the sum, so the totals are kept from going down in between.
+    '''
+
+    def __init__(self, pid):
+        self.root = psutil.Process(pid)
+        # pid -> Process, so each process is only created once
+        self.procs = {}
+        self.last_uss = {}
+        # cpu seconds, read bytes, write bytes
+        self.totals = [0., 0, 0]
+        self.prev_cpu = None
+        self.prev_t = None
+
+    def tree(self):
+        try:
+            children = self.root.children(recursive=True)
+        except psutil.Error:
+            children = []
+        current = {}
+        for p in [self.root] + children:
+            current[p.pid] = self.procs.get(p.pid, p)
+        self.procs = current
+        return current.values()
+
+    def sample(self, with_uss=False):
+        t = time.monotonic()
+        rss = uss = n_threads = n_procs = 0
+        totals = [0., 0, 0]
+        seen = set()
+        for p in self.tree():
+            try:
+                with p.oneshot():
+                    cpu = p.cpu_times()
+                    mem = p.memory_info()
+                    threads = p.num_threads()
+                    try:
+                        io = p.io_counters()
+                        io = (io.read_bytes, io.write_bytes)
+                    except psutil.AccessDenied:
+                        io = (0, 0)
+                    if with_uss:
+                        self.last_uss[p.pid] = p.memory_full_info().uss
+            except psutil.Error:
+                # Exited between listing and reading it
+                continue
+            seen.add(p.pid)
+            totals[0] += (cpu.user + cpu.system
+                    + cpu.children_user + cpu.children_system)
+            totals[1] += io[0]
+            totals[2] += io[1]
+            rss += mem.rss
+            uss += self.last_uss.get(p.pid, 0)
+            n_threads += threads
+            n_procs += 1
+
+        for pid in self.last_uss.keys() - seen:
+            self.last_uss.pop(pid)
+        self.totals = [max(a, b) for a, b in zip(self.totals, totals)]
+        totals = self.totals
+
+        cpu_percent = 0.
+        if self.prev_t is not None and t > self.prev_t:
+            cpu_percent = max(
+                    0., 100. * (totals[0] - self.prev_cpu) / (t - self.prev_t))
+        self.prev_cpu, self.prev_t = totals[0], t
+
+        return rss, uss, cpu_percent, n_threads, n_procs, totals[1], totals[2]
+
+
+def run_sampled(command, output, interval=0.5, uss_interval=10., cgroup=None):
+    '''
+    Run command, sampling its process tree every interval seconds until it
+    exits. Returns the exit code of the command and a summary of the run.
+    With a JobCgroup the command runs in it, and the summary takes peak
+    memory, CPU time and I/O from the cgroup where available.
+    '''
+    wall_start = time.monotonic()
+    child = subprocess.Popen(
+            command,
+            preexec_fn=cgroup.enter if cgroup is not None else None
+            )
+
+    # Pass termination on to the command, e.g. when snakemake is stopped
+    def forward(signum, frame):
+        child.send_signal(signum)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    summary = {
+            'max_rss': 0, 'max_uss': 0,
+            'io_in': 0, 'io_out': 0, 'cpu_time': 0.
+            }
+    max_current = None
+    with SeriesWriter(output, interval) as writer:
+        try:
+            sampler = TreeSampler(child.pid)
+        except psutil.NoSuchProcess:
+            sampler = None
+
+        start = time.monotonic()
+        next_uss = start
+        tick = 0
+        returncode = child.poll() if sampler is not None else child.wait()
+        while returncode is None:
+            now = time.monotonic()
+            with_uss = now >= next_uss
+            if with_uss:
+                next_uss = now + uss_interval
+            values = sampler.sample(with_uss=with_uss)
+            writer.write(now - start, *values)
+
+            rss, uss, _, _, _, read_bytes, write_bytes = values
+            summary['max_rss'] = max(summary['max_rss'], rss)
+            summary['max_uss'] = max(summary['max_uss'], uss)
+            summary['io_in'], summary['io_out'] = read_bytes, write_bytes
+            summary['cpu_time'] = sampler.totals[0]
+            if cgroup is not None:
+                current = cgroup.memory_current()
+                if current is not None:
+                    max_current = max(max_current or 0, current)
+
+            # Keep to the schedule, regardless of how long sampling took.
+            # Ticks missed while sampling a large tree are skipped
+            tick = max(tick + 1, int((time.monotonic() - start) / interval))
+            timeout = max(0., start + tick * interval - time.monotonic())
+            try:
+                returncode = child.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                pass
+
+    summary['s'] = time.monotonic() - wall_start
+    if cgroup is not None:
+        peak = cgroup.memory_peak()
+        if peak is None:
+            peak = max_current
+        if peak is not None:
+            summary['max_rss'] = peak
+        cpu_time = cgroup.cpu_seconds()
+        if cpu_time is not None:
+            summary['cpu_time'] = cpu_time
+        io = cgroup.io_bytes()
+        if io is not None:
+            summary['io_in'], summary['io_out'] = io
+    return returncode, summary
+
+
+def write_benchmark(summary, benchmark_tsv):
+    '''
+    Write the summary of a run like snakemake's benchmark directive does,
+    so that concatenate_benchmarks.py picks it up with everything else
+    '''
+    def to_tsv_str(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return '{:.2f}'.format(value)
+        return str(value)
+
+    running_time = summary['s']
+    row = [
+            '{:.4f}'.format(running_time),
+            str(datetime.timedelta(seconds=int(running_time))),
+            summary['max_rss'] / 1024**2,
+            None, # max_vms
+            summary['max_uss'] / 1024**2,
+            None, # max_pss
+            summary['io_in'] / 1024**2,
+            summary['io_out'] / 1024**2,
+            100. * summary['cpu_time'] / running_time if running_time else 0.,
+            float(summary['cpu_time']),
+            ]
+    header = [
+            's', 'h:m:s', 'max_rss', 'max_vms', 'max_uss', 'max_pss',
+            'io_in', 'io_out', 'mean_load', 'cpu_time'
+            ]
+    benchmark_tsv.parent.mkdir(parents=True, exist_ok=True)
+    with open(benchmark_tsv, 'w') as fout:
+        fout.write('\t'.join(header) + '\n')
+        fout.write('\t'.join(to_tsv_str(v) for v in row) + '\n')
+
+
+def main():
+    args = parse_arguments()
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    cgroup = None
+    if args.cgroup:
+        try:
+            cgroup = JobCgroup(
+                    'benchmark_assembly.{}'.format(os.getpid()),
+                    parent=args.cgroup_parent
+                    )
+        except CgroupError as e:
+            print("Falling back to process tree accounting, {}".format(e))
+
+    try:
+        returncode, summary = run_sampled(
+                args.command,
+                args.output,
+                interval=args.interval,
+                uss_interval=args.uss_interval,
+                cgroup=cgroup
+                )
+    finally:
+        if cgroup is not None:
+            cgroup.remove()
+
+    if args.benchmark is not None:
+        write_benchmark(summary, args.benchmark)
+    # Same convention as the shell for commands killed by a signal
+    if returncode < 0:
+        returncode = 128 - returncode
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+'''
+Binary time series of resource usage, written by resource_sampler.py
+
+A series is a single file laid out as
+
+    header | record | record | ...
+
+with fixed size little endian records, so it can be appended to while the
+job runs and read back in one go with numpy.
+'''
+
+import struct
+import time
+
+
+MAGIC = b'BASERIE1'
+# magic, sampling interval (s), start of sampling (epoch s)
+HEADER = struct.Struct('<8sdd')
+
+# Name and struct code of every field in a record
+FIELDS = [
+        ('t', 'd'),             # seconds since start
+        ('rss', 'Q'),           # bytes, summed over the process tree
+        ('uss', 'Q'),           # bytes, summed over the process tree
+        ('cpu_percent', 'f'),   # 100 = one core busy
+        ('n_threads', 'I'),
+        ('n_procs', 'I'),
+        ('read_bytes', 'Q'),    # cumulative, including exited processes
+        ('write_bytes', 'Q'),   # cumulative, including exited processes
+        ]
+RECORD = struct.Struct('<' + ''.join(code for _, code in FIELDS))
+
+
+class SeriesWriter:
+    '''
+    Append records to a series file. Records are flushed to disk every
+    flush_every seconds, so a killed job still leaves a readable series.
+    '''
+
+    def __init__(self, path, interval, flush_every=10.):
+        self.fout = open(path, 'wb')
+        self.start = time.time()
+        self.fout.write(HEADER.pack(MAGIC, interval, self.start))
+        self.flush_every = flush_every
+        self.last_flush = time.monotonic()
+
+    def write(self, *values):
+        self.fout.write(RECORD.pack(*values))
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_every:
+            self.fout.flush()
+            self.last_flush = now
+
+    def close(self):
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_series(path):
+    '''
+    Read a series into a numpy structured array, with one column per
+    field. Returns the array, the sampling interval and the start time.
+    '''
+    # Only needed for reading. The assembly env, where the sampler runs,
+    # has no numpy
+    import numpy as np
+
+    dtype = np.dtype([(name, '<' + code) for name, code in FIELDS])
+    with open(path, 'rb') as fin:
+        data = fin.read()
+    magic, interval, start = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("{} is not a resource series".format(path))
+    # A job killed mid-write can leave a partial record at the end
+    n_records = (len(data) - HEADER.size) // RECORD.size
+    records = np.frombuffer(
+            data, dtype=dtype, count=n_records, offset=HEADER.size)
+    return records, interval, start
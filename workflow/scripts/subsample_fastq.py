@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+'''
+Subsample a pair of fastq files to several nested depths in a single pass
+
+Two modes, neither keeps reads in memory:
+
+exact
+    Each dataset gets exactly the read pairs asked for. Needs the total
+    read pairs of the input, from an earlier counting pass. Sequential
+    selection sampling (Knuth's algorithm S) picks every pair with
+    probability (pairs still needed) / (pairs left). The pairs of a larger
+    dataset are picked the same way from those not in the smaller ones.
+
+fraction
+    Every read pair draws one uniform number u and goes to each dataset
+    whose fraction is larger than u. Sizes are binomial around fraction *
+    total, and the input is read once.
+
+In both, the pairs of a smaller dataset are also in all the larger ones.
+'''
+
+import argparse
+import bisect
+from itertools import zip_longest
+from pathlib import Path
+import random
+
+from compressed_io import BUFFER_SIZE, open_input, open_output
+
+
+def parse_arguments():
+    parser=argparse.ArgumentParser(
+            description="Subsample paired fastq files to several nested "
+            "depths, decompressing the input only once"
+            )
+
+    optionalArgs = parser._action_groups.pop()
+    optionalArgs.title = "Optional Arguments"
+
+    requiredArgs = parser.add_argument_group("Required Arguments")
+
+    requiredArgs.add_argument(
+            "-1",
+            "--r1",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="R1 fastq, plain or gzip, bgzip or zstd compressed",
+            dest="r1",
+            required=True,
+            )
+    requiredArgs.add_argument(
+            "-2",
+            "--r2",
+            type=lambda p: Path(p).resolve(strict=True),
+            help="R2 fastq, plain or gzip, bgzip or zstd compressed. Not "
+            "needed with --count-only",
+            dest="r2",
+            default=None,
+            )
+    requiredArgs.add_argument(
+            "-d",
+            "--dataset",
+            nargs=4,
+            action="append",
+            metavar=("NAME", "SIZE", "OUT_R1", "OUT_R2"),
+            dest="datasets",
+            default=None,
+            help="A dataset to write. SIZE is in read pairs in exact mode, "
+            "a fraction of the input in fraction mode. Can be given "
+            "multiple times. Not needed with --count-only"
+            )
+    optionalArgs.add_argument(
+            "-m",
+            "--mode",
+            choices=["exact", "fraction"],
+            default="exact",
+            dest="mode",
+            help="Sampling mode, see the description [default = exact]"
+            )
+    optionalArgs.add_argument(
+            "-N",
+            "--total",
+            # awk may print large counts as floats
+            type=lambda v: int(float(v)),
+            default=None,
+            dest="total",
+            help="Number of read pairs in the input. Required in exact mode"
+            )
+    optionalArgs.add_argument(
+            "-s",
+            "--seed",
+            type=int,
+            default=11,
+            dest="seed",
+            help="Random seed [default = 11]"
+            )
+    optionalArgs.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=4,
+            dest="threads",
+            help="Threads shared by the compressors of all outputs. Each "
+            "gets at least one [default = 4]"
+            )
+    optionalArgs.add_argument(
+            "-c",
+            "--counts",
+            type=lambda p: Path(p).resolve(),
+            default=None,
+            dest="counts",
+            help="Write the read pairs of every dataset, and of the input "
+            "as dataset 'full', to this tsv"
+            )
+
+    optionalArgs.add_argument(
+            "--count-only",
+            action="store_true",
+            default=False,
+            dest="count_only",
+            help="Only print the read pairs of the input, counted from R1, "
+            "for -N"
+            )
+
+    parser._action_groups.append(optionalArgs)
+
+    args = parser.parse_args()
+    if args.count_only:
+        return args
+    if args.r2 is None or not args.datasets:
+        parser.error("subsampling needs -2 and at least one -d")
+    if args.mode == "exact" and args.total is None:
+        parser.error("exact mode needs the read pairs of the input, -N")
+    return args
+
+
+def fraction_selector(fractions, rng):
+    '''
+    Index of the smallest dataset a read pair goes to, len(fractions) for
+    none. fractions must be sorted.
+    '''
+    rand = rng.random
+    max_fraction = fractions[-1]
+    n_datasets = len(fractions)
+    def select():
+        u = rand()
+        if u >= max_fraction:
+            return n_datasets
+        return bisect.bisect_right(fractions, u)
+    return select
+
+
+def exact_selector(total, sizes, rng):
+    '''
+    Same as fraction_selector, for datasets of exactly sizes read pairs out
+    of total
+    '''
+    rand = rng.random
+    sizes = [min(size, total) for size in sizes]
+    smaller = [0] + sizes[:-1]
+    # Dataset k picks its new pairs from those not in datasets before it
+    need = [size - prev for prev, size in zip(smaller, sizes)]
+    left = [total - prev for prev in smaller]
+    n_datasets = len(sizes)
+    def select():
+        for k in range(n_datasets):
+            picked = rand() * left[k] < need[k]
+            left[k] -= 1
+            if picked:
+                need[k] -= 1
+                return k
+        return n_datasets
+    return select
+
+
+def read_name(header):
+    name = header.split(None, 1)[0]
+    if name.endswith((b'/1', b'/2')):
+        name = name[:-2]
+    return name
+
+
+def subsample(r1, r2, datasets, mode='exact', total=None, seed=11, threads=4):
+    '''
+    Write the nested subsets of datasets, (name, size, out R1, out R2)
+    tuples, in one pass over r1 and r2. Returns the read pairs written to
+    each dataset and the read pairs of the input.
+    '''
+    size_type = int if mode == 'exact' else float
+    # Smallest first. A pair then goes to all datasets from the one the
+    # selector returns onwards
+    datasets = sorted(datasets, key=lambda d: size_type(d[1]))
+    sizes = [size_type(d[1]) for d in datasets]
+    rng = random.Random(seed)
+    if mode == 'exact':
+        select = exact_selector(total, sizes, rng)
+    else:
+        select = fraction_selector(sizes, rng)
+    n_datasets = len(datasets)
+    counts = [0] * n_datasets
+
+    # The threads are shared by the compressors of all outputs
+    io_threads = max(1, threads // (2 * n_datasets))
+    writers = [
+            (
+                open_output(out_r1, 'wb', io_threads),
+                open_output(out_r2, 'wb', io_threads)
+                )
+            for _, _, out_r1, out_r2 in datasets
+            ]
+    readers = [
+            open_input(r1, 'rb', io_threads),
+            open_input(r2, 'rb', io_threads)
+            ]
+    records1 = zip_longest(*[iter(readers[0])] * 4)
+    records2 = zip_longest(*[iter(readers[1])] * 4)
+
+    pair_no = 0
+    for rec1, rec2 in zip_longest(records1, records2):
+        if rec1 is None or rec2 is None or rec1[3] is None or rec2[3] is None:
+            raise ValueError(
+                    "{} and {} differ in length or end in a partial record "
+                    "after {} read pairs".format(r1, r2, pair_no)
+                    )
+        pair_no += 1
+        first = select()
+        if first == n_datasets:
+            continue
+        if read_name(rec1[0]) != read_name(rec2[0]):
+            raise ValueError("Read pair {} is out of sync: {} and {}".format(
+                pair_no, rec1[0].strip(), rec2[0].strip()))
+        for i in range(first, n_datasets):
+            writers[i][0].writelines(rec1)
+            writers[i][1].writelines(rec2)
+            counts[i] += 1
+
+    if mode == 'exact' and pair_no != total:
+        raise ValueError(
+                "Expected {} read pairs in {} and {}, found {}".format(
+                    total, r1, r2, pair_no)
+                )
+
+    for reader in readers:
+        reader.close()
+    for writer1, writer2 in writers:
+        writer1.close()
+        writer2.close()
+
+    return {d[0]: n for d, n in zip(datasets, counts)}, pair_no
+
+
+def count_read_pairs(r1, threads=1):
+    '''
+    Read pairs of the input, from the lines of r1
+    '''
+    n_lines = 0
+    last = b'\n'
+    with open_input(r1, 'rb', threads) as fin:
+        while True:
+            chunk = fin.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            n_lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # The last line may lack its newline
+    if last != b'\n':
+        n_lines += 1
+    return n_lines // 4
+
+
+def main():
+    args = parse_arguments()
+
+    if args.count_only:
+        print(count_read_pairs(args.r1, args.threads))
+        return
+
+    counts, total = subsample(
+            args.r1, args.r2, args.datasets,
+            mode=args.mode,
+            total=args.total,
+            seed=args.seed,
+            threads=args.threads
+            )
+    for name, read_pairs in counts.items():
+        print("{}: {} of {} read pairs".format(name, read_pairs, total))
+
+    if args.counts:
+        with open(args.counts, 'w') as fout:
+            fout.write('dataset\tread_pairs\n')
+            for name, read_pairs in counts.items():
+                fout.write('{}\t{}\n'.format(name, read_pairs))
+            fout.write('full\t{}\n'.format(total))
+
+
+if __name__ == '__main__':
+    main()
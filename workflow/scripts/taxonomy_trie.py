@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+'''
+Lineages of CAT and RAT as paths in a trie of integer taxids
+
+Nodes are indices into flat arrays: taxid, parent and flags of every node,
+and one array per count column. A node is created after its parent, so a
+single reverse pass rolls the counts of all nodes up to their ancestors.
+Suggestive classifications ('*' in CAT and RAT lineages) are separate
+nodes, with the star kept as a flag bit, so they can be filtered or merged
+with their plain equivalents when emitting.
+
+Every distinct lineage string is split once, and the names of a node are
+looked up once and built from those of its parent, however many contigs or
+samples share it. The structure is kept across samples of a batch, only
+the counts are cleared.
+'''
+
+from array import array
+
+from compressed_io import open_input
+
+
+# Flag bits of a node
+STAR = 1
+# The node or one of its ancestors is starred
+STARRED = 2
+
+
+class TaxonomyTrie:
+    '''
+    Trie of numeric lineages with one or more count columns, of the given
+    array typecodes
+    '''
+
+    def __init__(self, tax_dic=None, typecodes='q'):
+        self.tax_dic = tax_dic
+        self.typecodes = typecodes
+        # Node 0 is above the root of the taxonomy, taxid 1
+        self.taxids = array('q', [0])
+        self.parents = array('q', [-1])
+        self.flags = bytearray(1)
+        self.counts = [array(t, [0]) for t in typecodes]
+        # (parent node, taxid << 1 | star) -> node
+        self._children = {}
+        # lineage string -> node
+        self._nodes = {}
+        # node -> tuple of names
+        self._names = {0: ()}
+
+    def __len__(self):
+        return len(self.taxids)
+
+    def node(self, lineage_string):
+        '''
+        Node of a numeric lineage, e.g. '1;131567;2*', created if new
+        '''
+        try:
+            return self._nodes[lineage_string]
+        except KeyError:
+            pass
+
+        node = 0
+        for level in lineage_string.split(';'):
+            star = level.endswith('*')
+            taxid = int(level[:-1]) if star else int(level)
+            key = (node, taxid << 1 | star)
+            child = self._children.get(key)
+            if child is None:
+                child = len(self.taxids)
+                self._children[key] = child
+                self.taxids.append(taxid)
+                self.parents.append(node)
+                flags = STAR if star else 0
+                if star or self.flags[node] & STARRED:
+                    flags |= STARRED
+                self.flags.append(flags)
+                for counts in self.counts:
+                    counts.append(0)
+            node = child
+        self._nodes[lineage_string] = node
+        return node
+
+    def add(self, lineage_string, *values):
+        node = self.node(lineage_string)
+        for counts, value in zip(self.counts, values):
+            counts[node] += value
+        return node
+
+    def clear_counts(self):
+        self.counts = [array(t, [0]) * len(self) for t in self.typecodes]
+
+    def is_starred(self, node):
+        return bool(self.flags[node] & STARRED)
+
+    def nodes_with_counts(self):
+        '''
+        Nodes with a count of their own in any column
+        '''
+        for node in range(1, len(self)):
+            if any(counts[node] for counts in self.counts):
+                yield node
+
+    def path(self, node):
+        '''
+        Nodes from the root down to node
+        '''
+        nodes = []
+        while node > 0:
+            nodes.append(node)
+            node = self.parents[node]
+        return nodes[::-1]
+
+    def lineage_string(self, node, stars=True):
+        '''
+        The numeric lineage of node, with or without stars
+        '''
+        return ';'.join(
+                str(self.taxids[n]) + ('*' if stars and self.flags[n] & STAR else '')
+                for n in self.path(node)
+                )
+
+    def names(self, node):
+        '''
+        Names of the taxa from the root down to node
+        '''
+        try:
+            return self._names[node]
+        except KeyError:
+            pass
+
+        try:
+            name = self.tax_dic[self.taxids[node]]
+        except KeyError:
+            print(self.lineage_string(node))
+            raise
+        names = self.names(self.parents[node]) + (name,)
+        self._names[node] = names
+        return names
+
+    def krona_counts(self, col=0, include_stars=False):
+        '''
+        Counts of column col per lineage of names, for ktImportText.
+        Starred lineages are left out, or merged with their plain
+        equivalents when include_stars
+        '''
+        counts = self.counts[col]
+        krona = {}
+        for node in range(1, len(self)):
+            count = counts[node]
+            if not count:
+                continue
+            if not include_stars and self.flags[node] & STARRED:
+                continue
+            names = self.names(node)
+            krona[names] = krona.get(names, 0) + count
+        return krona
+
+    def rolled_up(self, col=0, include_stars=True):
+        '''
+        Counts of column col of every node with those of its descendants
+        '''
+        totals = array(self.counts[col].typecode, self.counts[col])
+        for node in range(len(self) - 1, 0, -1):
+            if not include_stars and self.flags[node] & STARRED:
+                continue
+            totals[self.parents[node]] += totals[node]
+        return totals
+
+    def rank_counts(self, ranks, rank, col=0, include_stars=True):
+        '''
+        Rolled up counts of column col per taxid of the given rank, ranks
+        as returned by read_ranks
+        '''
+        totals = self.rolled_up(col, include_stars)
+        counts = {}
+        for node in range(1, len(self)):
+            if not include_stars and self.flags[node] & STARRED:
+                continue
+            taxid = self.taxids[node]
+            if ranks.get(taxid) == rank and totals[node]:
+                counts[taxid] = counts.get(taxid, 0) + totals[node]
+        return counts
+
+
+def read_ranks(nodes_dmp, taxids):
+    '''
+    Rank of every taxid in taxids, from NCBI's nodes.dmp
+    '''
+    taxids = set(taxids)
+    ranks = {}
+    with open_input(nodes_dmp) as fin:
+        for line in fin:
+            # taxid | parent taxid | rank | ...
+            taxid, _, rest = line.partition('\t|\t')
+            taxid = int(taxid)
+            if taxid in taxids:
+                ranks[taxid] = rest.split('\t|', 2)[1].strip()
+    return ranks